@@ -0,0 +1,169 @@
+# api/admission.py
+import asyncio
+import math
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from shared_state import SharedState
+
+T = TypeVar("T")
+
+
+class OverloadedError(Exception):
+    """The server (or an upstream service) is at capacity; retry after retry_after seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitedError(Exception):
+    """A client used up its rate limit; retry after retry_after seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AsyncPool:
+    """Caps how many coroutines run a section at once.
+
+    Up to limit callers run; up to max_waiting more queue for a slot for at
+    most timeout seconds. Anyone beyond that, or who times out, gets an
+    OverloadedError instead of piling onto an already saturated resource.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int = 100, timeout: float = 30.0):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self._waiting = 0
+
+    @property
+    def retry_after(self) -> float:
+        # A rough guess: the queue drains at `limit` callers per timeout window
+        return max(1.0, self.timeout * self._waiting / max(self.limit, 1) / 2)
+
+    def check_capacity(self):
+        # Raises the OverloadedError slot() would raise right now, without taking a slot
+        if self._semaphore.locked() and self._waiting >= self.max_waiting:
+            raise OverloadedError(f"Too many {self.name} requests are waiting", self.retry_after)
+
+    @asynccontextmanager
+    async def slot(self):
+        self.check_capacity()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise OverloadedError(f"Timed out waiting for a {self.name} slot", self.retry_after)
+        finally:
+            self._waiting -= 1
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets: rate tokens per second, holding at most burst.
+
+    A request costing more than the bucket holds is admitted once the bucket
+    is full and drives it negative, so large batches are possible but paid back
+    before the key's next request. With shared state the buckets live there
+    (under this limiter's name), so every worker draws from the same bucket.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000, name: str = "default",
+                 state: Optional[SharedState] = None):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.name = name
+        self.state = state
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._acquired = 0
+        self._lock = threading.Lock()
+        if state:
+            state.connection().execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    limiter TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (limiter, key)
+                )
+            """)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, key: str, cost: float = 1.0):
+        # With shared state this may wait on another worker's write, so call it off the event loop
+        if not self.enabled:
+            return
+        if self.state:
+            self._acquire_shared(key, cost)
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            self._buckets[key] = (self._take(tokens, updated, now, cost), now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+
+    def _take(self, tokens: float, updated: float, now: float, cost: float) -> float:
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        needed = min(cost, self.burst)
+        if tokens < needed:
+            raise RateLimitedError("Rate limit exceeded", math.ceil((needed - tokens) / self.rate))
+        return tokens - cost
+
+    def _acquire_shared(self, key: str, cost: float):
+        # Wall-clock time, since the buckets are compared across processes
+        now = time.time()
+        with self.state.transaction() as conn:
+            row = conn.execute(
+                "SELECT tokens, updated FROM rate_limits WHERE limiter = ? AND key = ?", (self.name, key)
+            ).fetchone()
+            tokens, updated = row if row else (self.burst, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (limiter, key, tokens, updated) VALUES (?, ?, ?, ?)",
+                (self.name, key, self._take(tokens, updated, now, cost), now)
+            )
+            with self._lock:
+                self._acquired += 1
+                prune = self._acquired % self.max_keys == 0
+            if prune:
+                conn.execute(
+                    "DELETE FROM rate_limits WHERE limiter = ? AND tokens + (? - updated) * ? >= ?",
+                    (self.name, now, self.rate, self.burst)
+                )
+
+    def _prune(self, now: float):
+        # Buckets that have refilled completely carry no state worth keeping
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if tokens + (now - updated) * self.rate >= self.burst:
+                del self._buckets[key]
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 20.0) -> float:
+    # Exponential backoff with full jitter, so a burst of callers does not retry in lockstep
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+async def retry_with_backoff(call: Callable[[], Awaitable[T]], should_retry: Callable[[Exception], bool],
+                             attempts: int = 4, base_delay: float = 1.0, max_delay: float = 20.0) -> T:
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == attempts - 1 or not should_retry(e):
+                raise
+            await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from shared_state import SharedState
+
+
+class AnswerCache:
+    """LRU/TTL cache of answers, scoped per collection (or per user within one).
+
+    Lookups match either the normalized question exactly or, failing that,
+    a cached question whose embedding has cosine similarity at or above
+    similarity_threshold. Within a scope, a variant (e.g. the documents a
+    question was narrowed to) must match too. Every scope has a version
+    counter; ingestion bumps it and entries stored under an older version
+    are treated as stale. With shared state the counters live there, so an
+    upload on one worker invalidates the answers every worker has cached.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600, similarity_threshold: float = 0.95,
+                 state: Optional[SharedState] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.state = state
+        self._entries: "OrderedDict[Tuple[str, str, str], dict]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if state:
+            state.connection().execute(
+                "CREATE TABLE IF NOT EXISTS answer_cache_versions (scope TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+
+    @staticmethod
+    def _normalize(question: str) -> str:
+        return normalize_text(question).lower().rstrip("?!. ")
+
+    def version(self, scope: str) -> int:
+        if self.state:
+            row = self.state.connection().execute(
+                "SELECT version FROM answer_cache_versions WHERE scope = ?", (scope,)
+            ).fetchone()
+            return row[0] if row else 0
+        with self._lock:
+            return self._versions.get(scope, 0)
+
+    def invalidate(self, scope: str):
+        if self.state:
+            self.state.connection().execute(
+                "INSERT INTO answer_cache_versions (scope, version) VALUES (?, 1) "
+                "ON CONFLICT (scope) DO UPDATE SET version = version + 1", (scope,)
+            )
+        with self._lock:
+            if not self.state:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+            for key in [key for key in self._entries if key[0] == scope]:
+                del self._entries[key]
+
+    def _fresh(self, entry: dict, version: int) -> bool:
+        return entry["version"] == version and time.time() - entry["created_at"] < self.ttl_seconds
+
+    def get_exact(self, scope: str, question: str, variant: str = "") -> Optional[str]:
+        key = (scope, variant, self._normalize(question))
+        version = self.version(scope)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not self._fresh(entry, version):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry["answer"]
+
+    def get_similar(self, scope: str, vector: List[float], variant: str = "") -> Optional[str]:
+        query = np.asarray(vector, dtype=np.float32)
+        query /= max(np.linalg.norm(query), 1e-12)
+        version = self.version(scope)
+        with self._lock:
+            keys, vectors = [], []
+            for key, entry in list(self._entries.items()):
+                if key[0] != scope or key[1] != variant:
+                    continue
+                if not self._fresh(entry, version):
+                    del self._entries[key]
+                    continue
+                keys.append(key)
+                vectors.append(entry["vector"])
+            if not keys:
+                return None
+            scores = np.stack(vectors) @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            self._entries.move_to_end(keys[best])
+            return self._entries[keys[best]]["answer"]
+
+    def put(self, scope: str, question: str, vector: List[float], answer: str, version: int, variant: str = ""):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector /= max(np.linalg.norm(vector), 1e-12)
+        key = (scope, variant, self._normalize(question))
+        current = self.version(scope)
+        with self._lock:
+            # An ingestion finished while this answer was being generated
+            if version != current:
+                return
+            self._entries[key] = {
+                "answer": answer,
+                "vector": vector,
+                "version": version,
+                "created_at": time.time()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
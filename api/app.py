@@ -1,76 +1,314 @@
-# api/app.py
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
-import uvicorn
-import os
-from dotenv import load_dotenv
-from pdf_processor import PDFProcessor
-from models import UserCreate, User, Question
-from database import get_db, Database
-
-# Load environment variables
-load_dotenv()
-
-# Initialize FastAPI app
-app = FastAPI()
-
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Initialize PDF Processor
-pdf_processor = PDFProcessor()
-
-# API Routes
-@app.post("/register")
-async def register(user: UserCreate, db: Database = Depends(get_db)):
-    db_user = db.get_user_by_email(user.email)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    return db.create_user(user.email, user.password)
-
-from pydantic import BaseModel
-
-class LoginRequest(BaseModel):
-    username: str
-    password: str
-
-@app.post("/token")
-async def login(form_data: LoginRequest, db: Database = Depends(get_db)):
-    try:
-        user = db.get_user_by_email(form_data.username)
-        print(user)
-        print(form_data)
-        if not user or form_data.password != user.password:
-            raise HTTPException(status_code=401, detail="Incorrect email or password")
-        return {"message": "Login successful"}
-    except Exception as e:
-        print(f"Login error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.post("/upload-pdfs")
-async def upload_pdfs(files: List[UploadFile] = File(...), db: Database = Depends(get_db)):
-    try:
-        await pdf_processor.process_pdfs(files, collection_name="default")  # Use a default collection name for simplicity
-        return {"message": "PDFs processed successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/ask")
-async def ask_question(question: Question, db: Database = Depends(get_db)):
-    try:
-        response = await pdf_processor.get_answer(question.question, collection_name="default")
-        return {"answer": response}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
+# api/app.py
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import BaseModel
+from typing import List, Optional
+from contextlib import asynccontextmanager
+import uvicorn
+import os
+import asyncio
+import json
+import logging
+import math
+import shutil
+import tempfile
+from dotenv import load_dotenv
+from pdf_processor import PDFProcessor
+from models import UserCreate, User, Question, BatchQuestion, JobStatus, DocumentInfo
+from database import get_db, init_db, close_db, Database
+from jobs import Job, JobManager, JobStore, QueueFullError
+from uploads import InvalidUploadError, UploadSpooler, UploadTooLargeError
+from telemetry import RequestContextMiddleware, configure_logging, get_telemetry
+from admission import OverloadedError, RateLimitedError, TokenBucketLimiter
+from shared_state import get_shared_state
+
+# Load environment variables
+load_dotenv()
+configure_logging(os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+telemetry = get_telemetry()
+# Job status, answer-cache versions and rate limits, shared by every worker (None keeps them per process)
+shared_state = get_shared_state()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    # Load the embedding model in the background so boot stays fast and /ready turns
+    # green on its own; with warmup off, the first request that embeds loads it
+    if os.getenv("MODEL_WARMUP", "1") == "1":
+        asyncio.get_running_loop().run_in_executor(None, pdf_processor.warmup)
+    yield
+    job_manager.shutdown()
+    pdf_processor.ocr.shutdown()
+    pdf_processor.embedder.shutdown()
+    close_db()
+
+# Initialize FastAPI app
+app = FastAPI(lifespan=lifespan)
+
+# Configure CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Request ids (X-Request-Id) for logs and trace spans, plus per-route latency metrics
+app.add_middleware(RequestContextMiddleware, telemetry=telemetry)
+
+# Initialize PDF Processor
+pdf_processor = PDFProcessor()
+
+# Ingestion runs on a worker pool so uploads never block the event loop
+job_manager = JobManager(
+    max_workers=int(os.getenv("INGEST_WORKERS", "2")),
+    max_queue_depth=int(os.getenv("INGEST_QUEUE_DEPTH", "16")),
+    store=JobStore(shared_state) if shared_state else None
+)
+SPOOL_DIR = os.getenv("SPOOL_DIR", tempfile.gettempdir())
+# Uploads stream to SPOOL_DIR block by block and are rejected as soon as a limit is crossed
+upload_spooler = UploadSpooler(
+    max_file_bytes=int(float(os.getenv("MAX_UPLOAD_FILE_MB", "200")) * 1024 * 1024),
+    max_request_bytes=int(float(os.getenv("MAX_UPLOAD_REQUEST_MB", "1000")) * 1024 * 1024),
+    block_size=int(os.getenv("UPLOAD_BLOCK_SIZE_KB", "1024")) * 1024
+)
+
+MAX_BATCH_QUESTIONS = int(os.getenv("ASK_BATCH_MAX_QUESTIONS", "500"))
+
+# Per-user token buckets; a rate of 0 turns a limit off. Each question (including
+# every question of a batch) costs one ask token, each upload request one upload token
+ask_limiter = TokenBucketLimiter(
+    rate=float(os.getenv("ASK_RATE_PER_MINUTE", "60")) / 60,
+    burst=float(os.getenv("ASK_BURST", "30")),
+    name="ask",
+    state=shared_state
+)
+upload_limiter = TokenBucketLimiter(
+    rate=float(os.getenv("UPLOAD_RATE_PER_MINUTE", "30")) / 60,
+    burst=float(os.getenv("UPLOAD_BURST", "10")),
+    name="upload",
+    state=shared_state
+)
+
+def _too_busy(error: Exception) -> HTTPException:
+    # 429 when this user is over their rate limit, 503 when the server (or Gemini) is
+    status_code = 429 if isinstance(error, RateLimitedError) else 503
+    return HTTPException(status_code=status_code, detail=str(error),
+                         headers={"Retry-After": str(math.ceil(error.retry_after))})
+
+async def _admit(limiter: TokenBucketLimiter, user_id: str, cost: float = 1):
+    try:
+        await run_in_threadpool(limiter.acquire, user_id, cost)
+    except RateLimitedError as e:
+        raise _too_busy(e)
+
+# All users share one collection; their points are separated by indexed user_id/doc_hash payload fields
+COLLECTION_NAME = "default"
+
+def _run_ingest(files, user_id: str, spool_path: str, db: Database, loop, job: Job):
+    try:
+        # Only documents that finished ingesting count as duplicates, not leftovers of a failed job
+        documents = asyncio.run_coroutine_threadsafe(db.list_documents(user_id), loop).result()
+        completed = {doc["doc_hash"] for doc in documents}
+        stats = pdf_processor.process_pdfs(files, COLLECTION_NAME, user_id, job=job, completed=completed)
+        for doc_hash in stats["documents_replaced"]:
+            asyncio.run_coroutine_threadsafe(db.delete_documents(user_id, doc_hash), loop).result()
+        if stats["documents"]:
+            asyncio.run_coroutine_threadsafe(db.add_documents(user_id, stats["documents"]), loop).result()
+    finally:
+        shutil.rmtree(spool_path, ignore_errors=True)
+
+# Requests authenticate with the opaque session token issued by /token: "Authorization: Bearer <token>"
+bearer_scheme = HTTPBearer(auto_error=False)
+
+async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+                           db: Database = Depends(get_db)) -> User:
+    user = await db.get_user_by_session(credentials.credentials) if credentials else None
+    if not user:
+        raise HTTPException(status_code=401, detail="Missing, invalid or expired session token",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return user
+
+# API Routes
+@app.get("/ready")
+async def ready():
+    # With a shared embedding server this asks it over a socket, so keep it off the event loop
+    model_loaded = await run_in_threadpool(lambda: pdf_processor.model_loaded)
+    if not model_loaded:
+        return JSONResponse(status_code=503, content={"ready": False, "model_loaded": False})
+    return {"ready": True, "model_loaded": True}
+
+@app.get("/metrics")
+async def metrics():
+    if not telemetry.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(telemetry.render(), media_type=telemetry.content_type)
+
+@app.post("/register")
+async def register(user: UserCreate, db: Database = Depends(get_db)):
+    db_user = await db.get_user_by_email(user.email)
+    if db_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return await db.create_user(user.email, user.password)
+
+from pydantic import BaseModel
+
+class LoginRequest(BaseModel):
+    username: str
+    password: str
+
+@app.post("/token")
+async def login(form_data: LoginRequest, db: Database = Depends(get_db)):
+    try:
+        user = await db.get_user_by_email(form_data.username)
+        if not user or form_data.password != user.password:
+            raise HTTPException(status_code=401, detail="Incorrect email or password")
+        token = await db.create_session(user.user_id)
+        return {"message": "Login successful", "access_token": token, "token_type": "bearer"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Login error")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/logout")
+async def logout(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+                 user: User = Depends(get_current_user), db: Database = Depends(get_db)):
+    await db.delete_session(credentials.credentials)
+    return {"message": "Logged out"}
+
+
+@app.post("/upload-pdfs", status_code=202)
+async def upload_pdfs(request: Request, user: User = Depends(get_current_user), db: Database = Depends(get_db)):
+    # The body is parsed by upload_spooler rather than declared as UploadFile parameters,
+    # so nothing is read (or buffered) before auth, rate limit, queue and size checks have passed
+    await _admit(upload_limiter, user.user_id)
+    if job_manager.is_full():
+        raise HTTPException(status_code=503, detail="Ingestion queue is full", headers={"Retry-After": "5"})
+
+    spool_path = tempfile.mkdtemp(prefix="upload-", dir=SPOOL_DIR)
+    try:
+        uploads = await upload_spooler.spool(request, spool_path)
+        spooled = [(upload.filename, upload.path, upload.sha256) for upload in uploads]
+        loop = asyncio.get_running_loop()
+        job = job_manager.submit(
+            lambda job: _run_ingest(spooled, user.user_id, spool_path, db, loop, job),
+            user_id=user.user_id
+        )
+    except UploadTooLargeError as e:
+        shutil.rmtree(spool_path, ignore_errors=True)
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidUploadError as e:
+        shutil.rmtree(spool_path, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFullError as e:
+        shutil.rmtree(spool_path, ignore_errors=True)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        shutil.rmtree(spool_path, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"message": "PDFs queued for processing", "job_id": job.id}
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str, user: User = Depends(get_current_user)):
+    job = await run_in_threadpool(job_manager.get, job_id)
+    # Another user's job is reported as missing, so job ids can't be probed
+    if not job or job.user_id != user.user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.status()
+
+@app.get("/documents", response_model=List[DocumentInfo])
+async def list_documents(user: User = Depends(get_current_user), db: Database = Depends(get_db)):
+    return await db.list_documents(user.user_id)
+
+@app.delete("/documents")
+async def delete_all_documents(user: User = Depends(get_current_user), db: Database = Depends(get_db)):
+    try:
+        await run_in_threadpool(pdf_processor.delete_documents, COLLECTION_NAME, user.user_id)
+        await db.delete_documents(user.user_id)
+        return {"message": "Documents deleted"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/documents/{doc_hash}")
+async def delete_document(doc_hash: str, user: User = Depends(get_current_user), db: Database = Depends(get_db)):
+    try:
+        await run_in_threadpool(pdf_processor.delete_documents, COLLECTION_NAME, user.user_id, [doc_hash])
+        await db.delete_documents(user.user_id, doc_hash)
+        return {"message": "Document deleted"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/ask")
+async def ask_question(question: Question, user: User = Depends(get_current_user)):
+    await _admit(ask_limiter, user.user_id)
+    try:
+        return await pdf_processor.get_answer(
+            question.question, COLLECTION_NAME, user.user_id, documents=question.documents
+        )
+    except OverloadedError as e:
+        raise _too_busy(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/ask/stream")
+async def ask_question_stream(question: Question, user: User = Depends(get_current_user)):
+    # Server-sent events: "retrieval", then "token" events, then "done" (or "error")
+    await _admit(ask_limiter, user.user_id)
+    # Once the stream has started, overload can only be reported as an "error" event
+    try:
+        pdf_processor.llm_pool.check_capacity()
+    except OverloadedError as e:
+        raise _too_busy(e)
+    
+    async def events():
+        try:
+            async for event, data in pdf_processor.stream_answer(
+                question.question, COLLECTION_NAME, user.user_id, documents=question.documents
+            ):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except OverloadedError as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e), 'retry_after': e.retry_after})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/ask/batch")
+async def ask_batch(batch: BatchQuestion, user: User = Depends(get_current_user)):
+    # Each result is {"index", "question", "answer", "cached"}, or {"index", "question", "error"}
+    if len(batch.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch")
+    await _admit(ask_limiter, user.user_id, cost=len(batch.questions))
+    answers = pdf_processor.get_answers(batch.questions, COLLECTION_NAME, user.user_id, documents=batch.documents)
+    
+    if batch.stream:
+        # Server-sent events: one "answer" per question in completion order, then "done"
+        async def events():
+            async for index, result in answers:
+                data = dict(index=index, question=batch.questions[index], **result)
+                yield f"event: answer\ndata: {json.dumps(data)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
+    results = [None] * len(batch.questions)
+    async for index, result in answers:
+        results[index] = dict(index=index, question=batch.questions[index], **result)
+    return {"results": results}
+
+if __name__ == "__main__":
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
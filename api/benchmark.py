@@ -0,0 +1,527 @@
+# api/benchmark.py
+"""Offline end-to-end benchmark for ingestion and question answering.
+
+    python benchmark.py --kind mixed --documents 8 --pages 20 --concurrency 4 --output bench.json
+    python benchmark.py --kind text --questions 200 --baseline bench.json
+
+Nothing external is needed except Tesseract for image pages: synthetic PDFs
+are generated on the fly, the embedding model and Gemini are replaced by
+deterministic fakes with configurable latency, Qdrant runs in-process
+(":memory:"), and SQLite files live in a temporary directory.
+
+Three phases run against the real pipeline code:
+  ingest_direct  PDFProcessor.process_pdfs on a thread pool
+  ingest_api     POST /upload-pdfs, then polling GET /jobs/{id} until done
+  ask            POST /ask
+
+Each phase reports wall time, per-stage busy time (stages overlap when
+running concurrently, so they can add up to more than the wall time),
+pages per second or latency percentiles, and peak RSS so far.
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import fitz
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from PIL import Image, ImageDraw
+
+DOCUMENT_KINDS = ("text", "image", "mixed")
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "de", "po", "gu", "ba", "ze", "fi", "ho", "ja"]
+
+
+# Synthetic documents
+
+def _vocabulary(rng: random.Random, size: int = 2000) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _sentences(rng: random.Random, vocabulary: List[str], words: int) -> str:
+    out, line = [], []
+    for _ in range(words):
+        line.append(rng.choice(vocabulary))
+        if len(line) >= rng.randint(8, 16):
+            out.append(" ".join(line).capitalize() + ".")
+            line = []
+    if line:
+        out.append(" ".join(line).capitalize() + ".")
+    return " ".join(out)
+
+
+def _page_image(rng: random.Random, vocabulary: List[str]) -> bytes:
+    # A "scanned" page: black text on white, large enough for Tesseract to read
+    image = Image.new("L", (1240, 1754), color=255)
+    draw = ImageDraw.Draw(image)
+    for row in range(40):
+        draw.text((80, 80 + row * 40), _sentences(rng, vocabulary, 12), fill=0)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_pdf(path: str, kind: str, pages: int, rng: random.Random, vocabulary: List[str]):
+    # text: a full text layer; image: a scanned image with a short caption; mixed: alternating
+    with fitz.open() as pdf_document:
+        for page_index in range(pages):
+            page = pdf_document.new_page()
+            page_kind = kind if kind != "mixed" else ("text" if page_index % 2 == 0 else "image")
+            if page_kind == "text":
+                page.insert_textbox(fitz.Rect(50, 50, 545, 792), _sentences(rng, vocabulary, 450), fontsize=9)
+            else:
+                page.insert_textbox(fitz.Rect(50, 30, 545, 70), _sentences(rng, vocabulary, 15), fontsize=9)
+                page.insert_image(fitz.Rect(50, 80, 545, 792), stream=_page_image(rng, vocabulary))
+        pdf_document.save(path)
+
+
+def make_corpus(directory: str, prefix: str, args, seed: int, vocabulary: List[str]) -> List[str]:
+    rng = random.Random(seed)
+    paths = []
+    for index in range(args.documents):
+        path = os.path.join(directory, f"{prefix}-{args.kind}-{index}.pdf")
+        make_pdf(path, args.kind, args.pages, rng, vocabulary)
+        paths.append(path)
+    return paths
+
+
+# Fakes for the embedding model and the LLM
+
+class FakeSentenceEncoder:
+    """Stands in for SentenceTransformer: hashed bag-of-words vectors, so retrieval still ranks by overlap."""
+
+    def __init__(self, dimension: int, batch_latency_ms: float, text_latency_ms: float):
+        self.dimension = dimension
+        self.batch_latency_ms = batch_latency_ms
+        self.text_latency_ms = text_latency_ms
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        time.sleep((self.batch_latency_ms + self.text_latency_ms * len(texts)) / 1000)
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                h = int.from_bytes(hashlib.blake2b(word.strip(".,").encode(), digest_size=8).digest(), "little")
+                vectors[row, h % self.dimension] += 1.0 if (h >> 32) & 1 else -1.0
+        if normalize_embeddings:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+
+class FakeEmbeddings:
+    # The attributes BatchingEmbedder and PDFProcessor read from HuggingFaceBgeEmbeddings
+    query_instruction = ""
+    encode_kwargs = {"normalize_embeddings": True}
+
+    def __init__(self, client: FakeSentenceEncoder):
+        self.client = client
+
+
+class FakeChatModel(BaseChatModel):
+    """Answers after latency_ms; streams the answer word by word, token_ms apart."""
+
+    latency_ms: float = 500.0
+    token_ms: float = 20.0
+    answer_words: int = 40
+    timings: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake"
+
+    def _answer(self, messages) -> List[str]:
+        prompt = "".join(str(message.content) for message in messages)
+        rng = random.Random(prompt)
+        words = prompt.split()
+        return [rng.choice(words) for _ in range(self.answer_words)] if words else ["ok"]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        started = time.perf_counter()
+        time.sleep((self.latency_ms + self.token_ms * self.answer_words) / 1000)
+        answer = " ".join(self._answer(messages))
+        self.timings.record("llm", time.perf_counter() - started)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        started = time.perf_counter()
+        await asyncio.sleep((self.latency_ms + self.token_ms * self.answer_words) / 1000)
+        answer = " ".join(self._answer(messages))
+        self.timings.record("llm", time.perf_counter() - started)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        started = time.perf_counter()
+        await asyncio.sleep(self.latency_ms / 1000)
+        for word in self._answer(messages):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            await asyncio.sleep(self.token_ms / 1000)
+        self.timings.record("llm", time.perf_counter() - started)
+
+
+# Measurement
+
+class StageTimings:
+    """Busy time per pipeline stage, collected by wrapping the functions that implement each stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, List[float]] = {}
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            totals = self._stages.setdefault(stage, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                stage: {"calls": calls, "total_s": total, "mean_ms": total / calls * 1000}
+                for stage, (calls, total) in sorted(self._stages.items())
+            }
+
+    def wrap(self, owner, name: str, stage: str):
+        fn = getattr(owner, name)
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+        else:
+            @functools.wraps(fn)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+        setattr(owner, name, timed)
+
+
+def _peak_rss_mb() -> dict:
+    # ru_maxrss is in KiB on Linux; children covers the OCR pool processes
+    return {
+        "process": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def _percentiles(latencies: List[float]) -> dict:
+    if not latencies:
+        return {}
+    values = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _configure_environment(work_dir: str):
+    # Must run before app/pdf_processor objects are created; explicit settings still win
+    defaults = {
+        "VECTOR_STORE": "qdrant",
+        "QDRANT_URL": ":memory:",
+        "DB_PATH": os.path.join(work_dir, "chat_app.db"),
+        "EMBED_CACHE_PATH": os.path.join(work_dir, "embedding_cache.db"),
+        "OCR_CACHE_PATH": os.path.join(work_dir, "ocr_cache.db"),
+        "SHARED_STATE_PATH": os.path.join(work_dir, "shared_state.db"),
+        "LOCAL_INDEX_PATH": os.path.join(work_dir, "vector_index"),
+        "SPOOL_DIR": work_dir,
+        "MODEL_WARMUP": "0",
+        # The fake embedder is installed in-process, so no shared embedding server
+        "EMBED_SERVER_SOCKET": "",
+        # The benchmark is one user hammering the API on purpose
+        "ASK_RATE_PER_MINUTE": "0",
+        "UPLOAD_RATE_PER_MINUTE": "0",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+def install_fakes(processor, args, timings: StageTimings):
+    import ocr
+
+    processor._embed_model = FakeEmbeddings(
+        FakeSentenceEncoder(args.embed_dimension, args.embed_batch_ms, args.embed_text_ms)
+    )
+    processor._llm = FakeChatModel(
+        latency_ms=args.llm_latency_ms, token_ms=args.llm_token_ms, answer_words=args.answer_words, timings=timings
+    )
+    timings.wrap(fitz.Page, "get_text", "extract")
+    timings.wrap(ocr.DocumentOCR, "ocr_pages", "ocr")
+    timings.wrap(processor, "_plan_revision", "plan")
+    timings.wrap(processor, "_get_text_chunks", "chunk")
+    timings.wrap(processor, "_embed_documents", "embed")
+    timings.wrap(processor.vector_store, "upsert", "upsert")
+    timings.wrap(processor.embedder, "aembed_query", "embed_query")
+    timings.wrap(processor.vector_store, "search", "search")
+    timings.wrap(processor.context_packer, "pack", "pack")
+
+
+# Phases
+
+def _page_count(paths: List[str]) -> int:
+    total = 0
+    for path in paths:
+        with fitz.open(path) as pdf_document:
+            total += pdf_document.page_count
+    return total
+
+
+def bench_ingest_direct(processor, paths: List[str], concurrency: int, timings: StageTimings) -> dict:
+    timings.reset()
+    pages = _page_count(paths)
+    latencies = []
+
+    def ingest(path: str):
+        started = time.perf_counter()
+        processor.process_pdfs([(os.path.basename(path), path, None)], "benchmark", "benchmark-direct")
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(ingest, paths))
+    wall = time.perf_counter() - started
+    return {
+        "documents": len(paths),
+        "pages": pages,
+        "wall_s": wall,
+        "pages_per_s": pages / wall,
+        "document_latency": _percentiles(latencies),
+        "stages": timings.report(),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+async def bench_ingest_api(client, headers: dict, paths: List[str], concurrency: int, timings: StageTimings) -> dict:
+    timings.reset()
+    pages = _page_count(paths)
+    semaphore = asyncio.Semaphore(concurrency)
+    upload_latencies, job_latencies, failures = [], [], []
+
+    async def ingest(path: str):
+        async with semaphore:
+            started = time.perf_counter()
+            with open(path, "rb") as f:
+                response = await client.post(
+                    "/upload-pdfs", headers=headers,
+                    files=[("files", (os.path.basename(path), f, "application/pdf"))]
+                )
+            upload_latencies.append(time.perf_counter() - started)
+            if response.status_code != 202:
+                failures.append(f"{path}: upload {response.status_code} {response.text}")
+                return
+            job_id = response.json()["job_id"]
+            while True:
+                status = (await client.get(f"/jobs/{job_id}", headers=headers)).json()
+                if status["stage"] in ("completed", "failed"):
+                    break
+                await asyncio.sleep(0.05)
+            job_latencies.append(time.perf_counter() - started)
+            if status["stage"] == "failed":
+                failures.append(f"{path}: {status['error']}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(ingest(path) for path in paths))
+    wall = time.perf_counter() - started
+    return {
+        "documents": len(paths),
+        "pages": pages,
+        "wall_s": wall,
+        "pages_per_s": pages / wall,
+        "upload_latency": _percentiles(upload_latencies),
+        "job_latency": _percentiles(job_latencies),
+        "failures": failures,
+        "stages": timings.report(),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+async def bench_ask(client, headers: dict, questions: List[str], concurrency: int, timings: StageTimings) -> dict:
+    timings.reset()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures, cached = [], [], 0
+
+    async def ask(question: str):
+        nonlocal cached
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post("/ask", headers=headers, json={"question": question})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                failures.append(f"{response.status_code} {response.text}")
+            elif response.json().get("cached"):
+                cached += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(ask(question) for question in questions))
+    wall = time.perf_counter() - started
+    return {
+        "questions": len(questions),
+        "wall_s": wall,
+        "questions_per_s": len(questions) / wall,
+        "cached": cached,
+        "failures": failures,
+        "latency": _percentiles(latencies),
+        "stages": timings.report(),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+async def run(args, work_dir: str) -> dict:
+    import httpx
+
+    # Imported here so the environment above is in place when the app builds its PDFProcessor
+    import app as api
+
+    timings = StageTimings()
+    install_fakes(api.pdf_processor, args, timings)
+
+    vocabulary = _vocabulary(random.Random(args.seed))
+    direct_paths = make_corpus(work_dir, "direct", args, args.seed + 1, vocabulary)
+    api_paths = make_corpus(work_dir, "api", args, args.seed + 2, vocabulary)
+    rng = random.Random(args.seed + 3)
+    questions = [
+        f"What does the document say about {' '.join(rng.sample(vocabulary, 3))}?" for _ in range(args.questions)
+    ]
+
+    results = {}
+    async with api.app.router.lifespan_context(api.app):
+        results["ingest_direct"] = await asyncio.to_thread(
+            bench_ingest_direct, api.pdf_processor, direct_paths, args.concurrency, timings
+        )
+
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            credentials = {"email": "bench@example.com", "password": "bench"}
+            await client.post("/register", json=credentials)
+            login = (await client.post("/token", json={"username": credentials["email"], "password": credentials["password"]})).json()
+            headers = {"Authorization": f"Bearer {login['access_token']}"}
+            results["ingest_api"] = await bench_ingest_api(client, headers, api_paths, args.concurrency, timings)
+            results["ask"] = await bench_ask(client, headers, questions, args.ask_concurrency, timings)
+    return results
+
+
+# Reporting
+
+SUMMARY_METRICS = [
+    ("ingest_direct", "pages_per_s"),
+    ("ingest_api", "pages_per_s"),
+    ("ask", "latency", "p50_ms"),
+    ("ask", "latency", "p95_ms"),
+    ("ask", "latency", "p99_ms"),
+    ("ask", "questions_per_s"),
+    ("ask", "peak_rss_mb", "process"),
+]
+
+
+def _lookup(results: dict, path) -> Optional[float]:
+    value = results
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def print_summary(report: dict, baseline: Optional[dict]):
+    for phase in ("ingest_direct", "ingest_api", "ask"):
+        print(f"\n{phase}")
+        for stage, row in report["results"][phase]["stages"].items():
+            print(f"  {stage:<14}{row['calls']:>8} calls{row['total_s']:>10.2f}s busy{row['mean_ms']:>10.2f} ms/call")
+    print(f"\n{'metric':<36}{'this run':>12}{'baseline':>12}{'change':>10}")
+    for path in SUMMARY_METRICS:
+        current = _lookup(report["results"], path)
+        previous = _lookup(baseline["results"], path) if baseline else None
+        change = f"{(current - previous) / previous * 100:+.1f}%" if current is not None and previous else "-"
+        print(f"{'.'.join(path):<36}{current if current is not None else float('nan'):>12.2f}"
+              f"{previous if previous is not None else float('nan'):>12.2f}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", choices=DOCUMENT_KINDS, default="mixed", help="Synthetic document type")
+    parser.add_argument("--documents", type=int, default=4, help="Documents per ingest phase")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per document")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent ingests")
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--ask-concurrency", type=int, default=8, help="Concurrent /ask requests")
+    parser.add_argument("--embed-dimension", type=int, default=384)
+    parser.add_argument("--embed-batch-ms", type=float, default=5.0, help="Fake embedder latency per batch")
+    parser.add_argument("--embed-text-ms", type=float, default=2.0, help="Fake embedder latency per text")
+    parser.add_argument("--llm-latency-ms", type=float, default=500.0, help="Fake LLM time to first token")
+    parser.add_argument("--llm-token-ms", type=float, default=20.0, help="Fake LLM time per answer word")
+    parser.add_argument("--answer-words", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", help="Earlier JSON output to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory (PDFs, databases)")
+    args = parser.parse_args()
+
+    if args.kind != "text" and not shutil.which("tesseract"):
+        sys.exit("Image pages need the tesseract binary; install it or use --kind text")
+
+    work_dir = tempfile.mkdtemp(prefix="benchmark-")
+    _configure_environment(work_dir)
+    try:
+        started = time.time()
+        results = asyncio.run(run(args, work_dir))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "commit": _git_commit(),
+        "started_at": started,
+        "config": vars(args),
+        "results": results,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_summary(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import math
+from typing import List, Optional
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from vector_store import SearchResult
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text; good enough for budgeting
+    return math.ceil(len(text) / 4)
+
+
+class ContextPacker:
+    """Turns over-fetched search results into a compact LLM context.
+
+    Near-identical chunks (same normalized text, or vectors above
+    dedupe_threshold) are dropped, the rest are picked by MMR so the context
+    covers different parts of the corpus, chunks that overlap or touch on
+    the same page are merged, and the result is cut to token_budget.
+    """
+
+    def __init__(self, max_chunks: int = 4, token_budget: int = 1000, mmr_lambda: float = 0.7,
+                 dedupe_threshold: float = 0.95):
+        self.max_chunks = max_chunks
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.dedupe_threshold = dedupe_threshold
+
+    def pack(self, query_vector: List[float], results: List[SearchResult]) -> List[SearchResult]:
+        results = [r for r in results if r.text]
+        if not results:
+            return []
+        vectors = self._normalized([r.vector for r in results]) if all(r.vector for r in results) else None
+        query = self._normalized([query_vector])[0] if vectors is not None else None
+
+        candidates = self._dedupe(results, vectors)
+        selected = self._mmr(candidates, vectors, query)
+        merged = self._merge_adjacent([results[i] for i in selected])
+
+        packed, used = [], 0
+        for result in merged:
+            tokens = estimate_tokens(result.text)
+            if packed and used + tokens > self.token_budget:
+                break
+            packed.append(result)
+            used += tokens
+        return packed
+
+    @staticmethod
+    def _normalized(vectors) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    def _dedupe(self, results: List[SearchResult], vectors: Optional[np.ndarray]) -> List[int]:
+        kept, seen_texts = [], set()
+        for index, result in enumerate(results):
+            text = normalize_text(result.text)
+            if text in seen_texts:
+                continue
+            if vectors is not None and kept and float(np.max(vectors[kept] @ vectors[index])) >= self.dedupe_threshold:
+                continue
+            seen_texts.add(text)
+            kept.append(index)
+        return kept
+
+    def _mmr(self, candidates: List[int], vectors: Optional[np.ndarray], query: Optional[np.ndarray]) -> List[int]:
+        # Without vectors, fall back to the search engine's relevance order
+        if vectors is None:
+            return candidates[:self.max_chunks]
+        relevance = vectors[candidates] @ query
+        selected: List[int] = []
+        remaining = list(range(len(candidates)))
+        while remaining and len(selected) < self.max_chunks:
+            if selected:
+                redundancy = np.max(vectors[[candidates[i] for i in remaining]] @ vectors[[candidates[i] for i in selected]].T, axis=1)
+            else:
+                redundancy = np.zeros(len(remaining))
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            best = remaining[int(np.argmax(scores))]
+            selected.append(best)
+            remaining.remove(best)
+        return [candidates[i] for i in selected]
+
+    @staticmethod
+    def _merge_adjacent(results: List[SearchResult]) -> List[SearchResult]:
+        # Chunks from the same page whose character ranges overlap or touch become one
+        merged: List[SearchResult] = []
+        for result in results:
+            for position, other in enumerate(merged):
+                meta, other_meta = result.metadata, other.metadata
+                if (meta.get("doc_hash") is None or meta.get("doc_hash") != other_meta.get("doc_hash")
+                        or meta.get("page_number") != other_meta.get("page_number")
+                        or meta.get("offset") is None or other_meta.get("offset") is None):
+                    continue
+                first, second = (other, result) if other_meta["offset"] <= meta["offset"] else (result, other)
+                first_end = first.metadata["offset"] + len(first.text)
+                if second.metadata["offset"] > first_end:
+                    continue
+                overlap = first_end - second.metadata["offset"]
+                text = first.text + second.text[overlap:]
+                merged[position] = first._replace(text=text, score=max(first.score, second.score))
+                break
+            else:
+                merged.append(result)
+        return merged
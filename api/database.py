@@ -1,64 +1,249 @@
-# api/database.py
-import sqlite3
-from contextlib import contextmanager
-import hashlib
-from models import User
-import os
-
-class Database:
-    def __init__(self, db_path: str):
-        self.db_path = db_path
-        self.init_db()
-
-    @contextmanager
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        try:
-            yield conn
-        finally:
-            conn.close()
-
-    def init_db(self):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    email TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    user_id TEXT UNIQUE NOT NULL
-                )
-            """)
-            conn.commit()
-
-    def create_user(self, email: str, password: str) -> User:
-        user_id = hashlib.md5(email.lower().encode()).hexdigest()
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO users (email, password, user_id) VALUES (?, ?, ?)",
-                (email, password, user_id)  # Store password as plain text
-            )
-            conn.commit()
-        return User(email=email, user_id=user_id, password=password)
-
-
-    def get_user_by_email(self, email: str) :
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT email, password, user_id FROM users WHERE email = ?",
-                (email,)
-            )
-            user = cursor.fetchone()
-            if user:
-                return User(
-                    email=user[0],
-                    password=user[1],
-                    user_id=user[2]
-                )
-        return None
-
-def get_db():
-    db = Database(os.getenv("DB_PATH", "chat_app.db"))
-    return db
\ No newline at end of file
+# api/database.py
+import asyncio
+import sqlite3
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import hashlib
+import secrets
+from typing import Dict, List, Optional, Tuple
+from models import User
+import os
+
+# Statements are kept as constants so each pooled connection's statement cache reuses them
+SELECT_USER_BY_EMAIL = "SELECT email, password, user_id FROM users WHERE email = ?"
+INSERT_USER = "INSERT INTO users (email, password, user_id) VALUES (?, ?, ?)"
+INSERT_DOCUMENT = "INSERT OR REPLACE INTO documents (user_id, doc_hash, pdf_name, created_at) VALUES (?, ?, ?, ?)"
+SELECT_DOCUMENTS = "SELECT doc_hash, pdf_name, created_at FROM documents WHERE user_id = ? ORDER BY created_at"
+DELETE_DOCUMENT = "DELETE FROM documents WHERE user_id = ? AND doc_hash = ?"
+DELETE_DOCUMENTS = "DELETE FROM documents WHERE user_id = ?"
+INSERT_SESSION = "INSERT INTO sessions (token_hash, user_id, expires_at) VALUES (?, ?, ?)"
+SELECT_USER_BY_SESSION = """
+    SELECT users.email, users.password, users.user_id, sessions.expires_at
+    FROM sessions JOIN users ON users.user_id = sessions.user_id
+    WHERE sessions.token_hash = ? AND sessions.expires_at > ?
+"""
+DELETE_SESSION = "DELETE FROM sessions WHERE token_hash = ?"
+DELETE_EXPIRED_SESSIONS = "DELETE FROM sessions WHERE expires_at <= ?"
+
+class Database:
+    def __init__(self, db_path: str, pool_size: int = 4, user_cache_ttl: float = 30,
+                 session_ttl: float = 86400):
+        self.db_path = db_path
+        self.user_cache_ttl = user_cache_ttl
+        self.session_ttl = session_ttl
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        # Queries run here so they never block the event loop
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db")
+        self._user_cache: Dict[str, Tuple[float, User]] = {}
+        self._session_cache: Dict[str, Tuple[float, User]] = {}
+        self._cache_lock = threading.Lock()
+        self.init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def get_connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.put(conn)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+    def init_db(self):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    email TEXT UNIQUE NOT NULL,
+                    password TEXT NOT NULL,
+                    user_id TEXT UNIQUE NOT NULL
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    user_id TEXT NOT NULL,
+                    doc_hash TEXT NOT NULL,
+                    pdf_name TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, doc_hash)
+                )
+            """)
+            # Only a hash of each session token is stored, so the table alone can't be used to log in
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    token_hash TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.commit()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def create_user(self, email: str, password: str) -> User:
+        return await self._run(self._create_user, email, password)
+
+    async def get_user_by_email(self, email: str) -> Optional[User]:
+        with self._cache_lock:
+            cached = self._user_cache.get(email)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        return await self._run(self._get_user, SELECT_USER_BY_EMAIL, email)
+
+    async def create_session(self, user_id: str) -> str:
+        return await self._run(self._create_session, user_id)
+
+    async def get_user_by_session(self, token: str) -> Optional[User]:
+        token_hash = self._token_hash(token)
+        with self._cache_lock:
+            cached = self._session_cache.get(token_hash)
+        if cached and cached[0] > time.time():
+            return cached[1]
+        return await self._run(self._get_user_by_session, token_hash)
+
+    async def delete_session(self, token: str):
+        await self._run(self._delete_session, self._token_hash(token))
+
+    async def add_documents(self, user_id: str, documents: List[dict]):
+        await self._run(self._add_documents, user_id, documents)
+
+    async def list_documents(self, user_id: str) -> List[dict]:
+        return await self._run(self._list_documents, user_id)
+
+    async def delete_documents(self, user_id: str, doc_hash: Optional[str] = None):
+        await self._run(self._delete_documents, user_id, doc_hash)
+
+    def _cache_user(self, user: User):
+        with self._cache_lock:
+            self._user_cache[user.email] = (time.monotonic() + self.user_cache_ttl, user)
+
+    def _create_user(self, email: str, password: str) -> User:
+        user_id = hashlib.md5(email.lower().encode()).hexdigest()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                INSERT_USER,
+                (email, password, user_id)  # Store password as plain text
+            )
+            conn.commit()
+        user = User(email=email, user_id=user_id, password=password)
+        self._cache_user(user)
+        return user
+
+
+    def _get_user(self, query: str, value: str) :
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (value,))
+            user = cursor.fetchone()
+            if user:
+                user = User(
+                    email=user[0],
+                    password=user[1],
+                    user_id=user[2]
+                )
+                self._cache_user(user)
+                return user
+        return None
+
+    @staticmethod
+    def _token_hash(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _create_session(self, user_id: str) -> str:
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        with self.get_connection() as conn:
+            conn.execute(DELETE_EXPIRED_SESSIONS, (now,))
+            conn.execute(INSERT_SESSION, (self._token_hash(token), user_id, now + self.session_ttl))
+            conn.commit()
+        return token
+
+    def _get_user_by_session(self, token_hash: str) -> Optional[User]:
+        with self.get_connection() as conn:
+            row = conn.execute(SELECT_USER_BY_SESSION, (token_hash, time.time())).fetchone()
+        if not row:
+            return None
+        user = User(email=row[0], password=row[1], user_id=row[2])
+        # Cached no longer than the session itself lives
+        expires = min(time.time() + self.user_cache_ttl, row[3])
+        with self._cache_lock:
+            self._session_cache[token_hash] = (expires, user)
+            if len(self._session_cache) > 10000:
+                now = time.time()
+                self._session_cache = {k: v for k, v in self._session_cache.items() if v[0] > now}
+        return user
+
+    def _delete_session(self, token_hash: str):
+        with self._cache_lock:
+            self._session_cache.pop(token_hash, None)
+        with self.get_connection() as conn:
+            conn.execute(DELETE_SESSION, (token_hash,))
+            conn.commit()
+
+    def _add_documents(self, user_id: str, documents: List[dict]):
+        now = time.time()
+        with self.get_connection() as conn:
+            conn.executemany(
+                INSERT_DOCUMENT,
+                [(user_id, doc["doc_hash"], doc["pdf_name"], now) for doc in documents]
+            )
+            conn.commit()
+
+    def _list_documents(self, user_id: str) -> List[dict]:
+        with self.get_connection() as conn:
+            rows = conn.execute(SELECT_DOCUMENTS, (user_id,)).fetchall()
+        return [{"doc_hash": row[0], "pdf_name": row[1], "created_at": row[2]} for row in rows]
+
+    def _delete_documents(self, user_id: str, doc_hash: Optional[str] = None):
+        with self.get_connection() as conn:
+            if doc_hash is None:
+                conn.execute(DELETE_DOCUMENTS, (user_id,))
+            else:
+                conn.execute(DELETE_DOCUMENT, (user_id, doc_hash))
+            conn.commit()
+
+_database: Optional[Database] = None
+_database_lock = threading.Lock()
+
+def init_db() -> Database:
+    # One process-wide Database, normally created by the app's lifespan handler
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = Database(
+                os.getenv("DB_PATH", "chat_app.db"),
+                pool_size=int(os.getenv("DB_POOL_SIZE", "4")),
+                user_cache_ttl=float(os.getenv("USER_CACHE_TTL", "30")),
+                session_ttl=float(os.getenv("SESSION_TTL_HOURS", "24")) * 3600
+            )
+        return _database
+
+def close_db():
+    global _database
+    with _database_lock:
+        if _database is not None:
+            _database.close()
+            _database = None
+
+def get_db():
+    return init_db()
\ No newline at end of file
@@ -0,0 +1,280 @@
+# api/embedding_server.py
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from embedding_service import BatchingEmbedder, load_embedding_model
+from telemetry import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Frames are a 4-byte big-endian length followed by the payload. A request is one
+# JSON frame; a reply is a JSON header frame, plus a frame of float32 vectors for "embed".
+_LENGTH = struct.Struct(">I")
+
+
+class EmbeddingServerError(RuntimeError):
+    pass
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def _send_frame(sock: socket.socket, payload: bytes):
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(min(size - len(buffer), 1 << 20))
+        if not chunk:
+            return None
+        buffer += chunk
+    return bytes(buffer)
+
+
+def _recv_frame(sock: socket.socket) -> Optional[bytes]:
+    header = _recv_exactly(sock, _LENGTH.size)
+    if header is None:
+        return None
+    return _recv_exactly(sock, _LENGTH.unpack(header)[0])
+
+
+class EmbeddingServer:
+    """Hosts one embedding model for every API worker on the box.
+
+    Workers connect over a Unix socket. Each connection is served by its own
+    thread, and all of them feed a single BatchingEmbedder, so texts from
+    different workers are encoded together in the same micro-batches and
+    the model (and torch's thread pool) exists once instead of per worker.
+    """
+
+    def __init__(self, socket_path: str, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.socket_path = socket_path
+        self._embed_model = None
+        self._model_lock = threading.Lock()
+        self.embedder = BatchingEmbedder(self.load_model, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self._server: Optional[_UnixServer] = None
+
+    def load_model(self):
+        if self._embed_model is None:
+            with self._model_lock:
+                if self._embed_model is None:
+                    self._embed_model = load_embedding_model()
+        return self._embed_model
+
+    def warmup(self):
+        self.embedder.embed_query("warmup")
+        logger.info("Embedding model loaded")
+
+    def handle(self, request: dict) -> Tuple[dict, Optional[bytes]]:
+        op = request.get("op")
+        if op == "info":
+            return {"model_loaded": self._embed_model is not None}, None
+        if op == "dimension":
+            return {"dimension": self.load_model().client.get_sentence_embedding_dimension()}, None
+        if op == "embed":
+            texts = request["texts"]
+            futures = self.embedder.submit(texts, is_query=bool(request.get("query")))
+            vectors = np.asarray([future.result() for future in futures], dtype=np.float32)
+            return {"count": len(texts), "dimension": vectors.shape[1] if texts else 0}, vectors.tobytes()
+        raise ValueError(f"Unknown operation {op!r}")
+
+    def serve_forever(self):
+        # A socket file left behind by a previous run would make bind fail
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    frame = _recv_frame(self.request)
+                    if frame is None:
+                        return
+                    try:
+                        header, payload = server.handle(json.loads(frame))
+                        header["ok"] = True
+                    except Exception as e:
+                        logger.exception("Embedding request failed")
+                        header, payload = {"ok": False, "error": str(e)}, None
+                    _send_frame(self.request, json.dumps(header).encode())
+                    if payload is not None:
+                        _send_frame(self.request, payload)
+
+        self._server = _UnixServer(self.socket_path, Handler)
+        os.chmod(self.socket_path, 0o600)
+        logger.info("Embedding server listening on %s", self.socket_path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self.embedder.shutdown()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class RemoteEmbedder:
+    """BatchingEmbedder's interface, backed by an EmbeddingServer.
+
+    Calls run on a small pool of threads, each holding one persistent
+    connection to the server, so at most max_connections requests per
+    worker are in flight. A connection that breaks (e.g. the server was
+    restarted) is reopened and the request retried once.
+    """
+
+    def __init__(self, socket_path: str, max_connections: int = 8, timeout: float = 60.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="embed-client")
+        self._local = threading.local()
+        self._sockets: List[socket.socket] = []
+        self._sockets_lock = threading.Lock()
+        self._model_loaded = False
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+            with self._sockets_lock:
+                self._sockets.append(sock)
+        return sock
+
+    def _disconnect(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            self._local.sock = None
+            with self._sockets_lock:
+                self._sockets.remove(sock)
+            sock.close()
+
+    def _call(self, request: dict) -> Tuple[dict, Optional[bytes]]:
+        data = json.dumps(request).encode()
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                _send_frame(sock, data)
+                frame = _recv_frame(sock)
+                if frame is None:
+                    raise ConnectionError("Embedding server closed the connection")
+                header = json.loads(frame)
+                payload = None
+                if header.get("ok") and request["op"] == "embed":
+                    payload = _recv_frame(sock)
+                    if payload is None:
+                        raise ConnectionError("Embedding server closed the connection")
+                break
+            except OSError as e:
+                self._disconnect()
+                if attempt:
+                    raise EmbeddingServerError(f"Embedding server at {self.socket_path} is unavailable: {e}") from e
+        if not header.get("ok"):
+            raise EmbeddingServerError(header.get("error", "Embedding request failed"))
+        return header, payload
+
+    def _embed(self, texts: List[str], is_query: bool) -> List[List[float]]:
+        if not texts:
+            return []
+        header, payload = self._call({"op": "embed", "texts": texts, "query": is_query})
+        self._model_loaded = True
+        return np.frombuffer(payload, dtype=np.float32).reshape(header["count"], header["dimension"]).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._executor.submit(self._embed, texts, False).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._executor.submit(self._embed, [text], True).result()[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.wrap_future(self._executor.submit(self._embed, texts, False))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await asyncio.wrap_future(self._executor.submit(self._embed, [text], True)))[0]
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.wrap_future(self._executor.submit(self._embed, texts, True))
+
+    def dimension(self) -> int:
+        return self._executor.submit(self._call, {"op": "dimension"}).result()[0]["dimension"]
+
+    def model_loaded(self, timeout: float = 1.0) -> bool:
+        # Once the server has the model it keeps it, so only ask until it says yes. The probe
+        # uses its own short-lived connection and timeout, so a hung server can't stall readiness checks
+        if not self._model_loaded:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.settimeout(timeout)
+                    sock.connect(self.socket_path)
+                    _send_frame(sock, json.dumps({"op": "info"}).encode())
+                    frame = _recv_frame(sock)
+            except OSError:
+                return False
+            self._model_loaded = bool(frame and json.loads(frame).get("model_loaded"))
+        return self._model_loaded
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._sockets_lock:
+            for sock in self._sockets:
+                sock.close()
+            self._sockets.clear()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Serve the embedding model to API workers over a Unix socket")
+    parser.add_argument("--socket", default=os.getenv("EMBED_SERVER_SOCKET", "/tmp/pdf_chat_embed.sock"),
+                        help="Unix socket path; point the workers' EMBED_SERVER_SOCKET at it")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("EMBED_BATCH_SIZE", "32")),
+                        help="Max texts per batched encode across all workers")
+    parser.add_argument("--batch-wait-ms", type=float, default=float(os.getenv("EMBED_BATCH_WAIT_MS", "5")),
+                        help="How long to wait to fill a batch")
+    parser.add_argument("--torch-threads", type=int, default=None,
+                        help="Threads torch uses for inference (default: torch's own choice)")
+    parser.add_argument("--no-warmup", action="store_true", help="Load the model on the first request instead")
+    args = parser.parse_args()
+
+    configure_logging(os.getenv("LOG_LEVEL", "INFO"))
+    if args.torch_threads:
+        import torch
+        torch.set_num_threads(args.torch_threads)
+
+    server = EmbeddingServer(args.socket, max_batch_size=args.batch_size, max_wait_ms=args.batch_wait_ms)
+    if not args.no_warmup:
+        threading.Thread(target=server.warmup, name="warmup", daemon=True).start()
+    # Unwind through serve_forever's cleanup, which removes the socket file
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
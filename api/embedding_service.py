@@ -0,0 +1,113 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Tuple
+
+from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+
+from telemetry import get_telemetry
+
+EMBED_MODEL_NAME = "BAAI/bge-large-en"
+
+_STOP = object()
+
+
+def load_embedding_model() -> HuggingFaceBgeEmbeddings:
+    return HuggingFaceBgeEmbeddings(
+        model_name=EMBED_MODEL_NAME,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True}
+    )
+
+
+class BatchingEmbedder:
+    """Micro-batches embedding requests from concurrent callers.
+
+    Texts are queued and a dedicated thread collects them for up to
+    max_wait_ms (or until max_batch_size is reached) before running a single
+    batched encode, then resolves each caller's future. Query texts get the
+    BGE query instruction prepended so queries and documents can share a batch.
+    The model comes from model_loader, which is first called on the
+    embedding thread so a lazy load never blocks the event loop.
+    """
+
+    def __init__(self, model_loader: Callable, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.model_loader = model_loader
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.telemetry = get_telemetry()
+        self._queue: "queue.Queue[Tuple[str, bool, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedder", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str], is_query: bool = False) -> List[Future]:
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((text.replace("\n", " "), is_query, future))
+            futures.append(future)
+        return futures
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [future.result() for future in self.submit(texts)]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit([text], is_query=True)[0].result()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.gather(*(asyncio.wrap_future(f) for f in self.submit(texts)))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit([text], is_query=True)[0])
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.gather(*(asyncio.wrap_future(f) for f in self.submit(texts, is_query=True)))
+
+    def shutdown(self):
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            stopping = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._encode(batch)
+            if stopping:
+                return
+
+    def _encode(self, batch: List[Tuple[str, bool, Future]]):
+        # Callers that gave up (e.g. a cancelled request) are dropped from the batch
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            embed_model = self.model_loader()
+            texts = [embed_model.query_instruction + text if is_query else text for text, is_query, _ in batch]
+            with self.telemetry.stage("model", "encode") as span:
+                vectors = embed_model.client.encode(texts, **embed_model.encode_kwargs)
+                span.add(len(texts))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), vector in zip(batch, vectors):
+            future.set_result(vector.tolist())
@@ -0,0 +1,226 @@
+import contextvars
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from models import JobStatus
+from shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobError(Exception):
+    # Raised by job functions with a message that is safe to show the job's owner
+    pass
+
+
+class Job:
+    def __init__(self, user_id: Optional[str] = None, store: Optional["JobStore"] = None):
+        self.id = str(uuid.uuid4())
+        self.user_id = user_id
+        self.stage = "queued"
+        self.pages_done = 0
+        self.pages_total = 0
+        self.error: Optional[str] = None
+        self.details: Dict[str, Any] = {}
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._store = store
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage: str):
+        with self._lock:
+            changed = stage != self.stage
+            self.stage = stage
+        self._save(force=changed)
+
+    def add_pages(self, count: int):
+        with self._lock:
+            self.pages_total += count
+        self._save(force=True)
+
+    def advance(self, count: int = 1):
+        with self._lock:
+            self.pages_done += count
+        self._save()
+
+    def update_details(self, **details):
+        with self._lock:
+            self.details.update(details)
+        self._save()
+
+    def complete(self):
+        with self._lock:
+            self.stage = "completed"
+            self.finished_at = time.time()
+        self._save(force=True)
+
+    def fail(self, error: str):
+        with self._lock:
+            self.stage = "failed"
+            self.error = error
+            self.finished_at = time.time()
+        self._save(force=True)
+
+    def _save(self, force: bool = False):
+        # Progress is written at most every save_interval; stage changes and the outcome always are
+        if self._store is None:
+            return
+        now = time.monotonic()
+        if force or now - self._saved_at >= self._store.save_interval:
+            self._saved_at = now
+            try:
+                self._store.save(self)
+            except sqlite3.Error:
+                # Reporting progress must not fail the ingestion itself
+                logger.exception("Could not save the status of job %s", self.id)
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def status(self) -> JobStatus:
+        with self._lock:
+            return JobStatus(
+                job_id=self.id,
+                stage=self.stage,
+                pages_done=self.pages_done,
+                pages_total=self.pages_total,
+                error=self.error,
+                details=dict(self.details)
+            )
+
+
+class JobStore:
+    """Job status kept in shared state, so any API worker can report a job another one runs.
+
+    Only the status is shared; a job runs on the worker that accepted its upload.
+    """
+
+    def __init__(self, state: SharedState, max_finished_jobs: int = 1000, save_interval: float = 0.5):
+        self.state = state
+        self.max_finished_jobs = max_finished_jobs
+        self.save_interval = save_interval
+        conn = self.state.connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                user_id TEXT,
+                stage TEXT NOT NULL,
+                pages_done INTEGER NOT NULL,
+                pages_total INTEGER NOT NULL,
+                error TEXT,
+                details TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                finished_at REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)")
+
+    def save(self, job: Job):
+        status = job.status()
+        conn = self.state.connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, user_id, stage, pages_done, pages_total, error, details, "
+            "created_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.id, job.user_id, status.stage, status.pages_done, status.pages_total, status.error,
+             json.dumps(status.details), job.created_at, job.finished_at)
+        )
+        if job.finished:
+            # Drop the oldest finished jobs once the history grows past its cap
+            conn.execute(
+                "DELETE FROM jobs WHERE job_id IN (SELECT job_id FROM jobs WHERE finished_at IS NOT NULL "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_finished_jobs,)
+            )
+
+    def load(self, job_id: str) -> Optional[Job]:
+        row = self.state.connection().execute(
+            "SELECT user_id, stage, pages_done, pages_total, error, details, created_at, finished_at "
+            "FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = Job(row[0])
+        job.id = job_id
+        job.stage, job.pages_done, job.pages_total, job.error = row[1:5]
+        job.details = json.loads(row[5])
+        job.created_at, job.finished_at = row[6], row[7]
+        return job
+
+
+class JobManager:
+    """Runs ingestion jobs on a thread pool with a bounded number of pending jobs.
+
+    With a store, job status is also written there and jobs this worker doesn't
+    run are looked up in it.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue_depth: int = 16, max_finished_jobs: int = 1000,
+                 store: Optional[JobStore] = None):
+        self.max_queue_depth = max_queue_depth
+        self.max_finished_jobs = max_finished_jobs
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._active = 0
+
+    def is_full(self) -> bool:
+        with self._lock:
+            return self._active >= self.max_queue_depth
+
+    def submit(self, fn: Callable[[Job], None], user_id: Optional[str] = None) -> Job:
+        with self._lock:
+            if self._active >= self.max_queue_depth:
+                raise QueueFullError("Ingestion queue is full, try again later")
+            job = Job(user_id, self.store)
+            self._jobs[job.id] = job
+            self._active += 1
+            self._prune()
+        job._save(force=True)
+        # Run in a copy of the caller's context so the request id follows the job into its logs
+        self._executor.submit(contextvars.copy_context().run, self._run, job, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        # This worker's own jobs are the freshest copy; the store may trail by save_interval
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store:
+            job = self.store.load(job_id)
+        return job
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job, fn: Callable[[Job], None]):
+        try:
+            fn(job)
+            job.complete()
+        except JobError as e:
+            job.fail(str(e))
+        except Exception:
+            # Other messages can carry server details such as spool paths, so they only go to the log
+            logger.exception("Job %s failed", job.id)
+            job.fail("Ingestion failed due to a server error")
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _prune(self):
+        # Drop the oldest finished jobs once the history grows past its cap
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
@@ -1,22 +1,41 @@
-# api/models.py
-from pydantic import BaseModel, EmailStr
-from typing import Optional
-
-class UserCreate(BaseModel):
-    email: EmailStr
-    password: str
-
-class User(BaseModel):
-    email: EmailStr
-    user_id: str
-    password: str
-
-class Token(BaseModel):
-    access_token: str
-    token_type: str
-
-class TokenData(BaseModel):
-    email: Optional[str] = None
-
-class Question(BaseModel):
-    question: str
\ No newline at end of file
+# api/models.py
+from pydantic import BaseModel, EmailStr
+from typing import Any, Dict, List, Optional
+
+class UserCreate(BaseModel):
+    email: EmailStr
+    password: str
+
+class User(BaseModel):
+    email: EmailStr
+    user_id: str
+    password: str
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str
+
+class TokenData(BaseModel):
+    email: Optional[str] = None
+
+class Question(BaseModel):
+    question: str
+    documents: Optional[List[str]] = None  # Restrict retrieval to these document hashes
+
+class BatchQuestion(BaseModel):
+    questions: List[str]
+    documents: Optional[List[str]] = None  # Restrict retrieval to these document hashes
+    stream: bool = False  # Stream each answer as it completes instead of returning them all at once
+
+class JobStatus(BaseModel):
+    job_id: str
+    stage: str
+    pages_done: int = 0
+    pages_total: int = 0
+    error: Optional[str] = None
+    details: Dict[str, Any] = {}
+
+class DocumentInfo(BaseModel):
+    doc_hash: str
+    pdf_name: str
+    created_at: float
\ No newline at end of file
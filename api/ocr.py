@@ -0,0 +1,129 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence
+
+import pytesseract
+from PIL import Image
+
+
+def _ocr_image(image_bytes: bytes) -> str:
+    # Runs inside a pool process, so it must stay a module-level function
+    image = Image.open(io.BytesIO(image_bytes))
+    return pytesseract.image_to_string(image)
+
+
+class OCRCache:
+    """Persistent OCR results keyed by the SHA-256 of the image bytes."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache (image_hash TEXT PRIMARY KEY, text TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, image_hash: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM ocr_cache WHERE image_hash = ?", (image_hash,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, image_hash: str, text: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (image_hash, text) VALUES (?, ?)",
+                (image_hash, text)
+            )
+            self._conn.commit()
+
+
+class OCRStage:
+    """OCRs the images of a fitz document on a process pool.
+
+    Pages whose extracted text layer is already dense are skipped, as are
+    images below a minimum pixel area. Each image is OCR'd at most once per
+    document (by xref and by content hash) and results are cached on disk.
+    """
+
+    def __init__(self):
+        self.max_workers = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+        self.dense_text_chars = int(os.getenv("OCR_DENSE_TEXT_CHARS", "1000"))
+        self.min_image_area = int(os.getenv("OCR_MIN_IMAGE_AREA", "10000"))
+        self.cache = OCRCache(os.getenv("OCR_CACHE_PATH", "ocr_cache.db"))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def document(self, pdf_document) -> "DocumentOCR":
+        return DocumentOCR(self, pdf_document)
+
+
+class DocumentOCR:
+    """OCR state for one open document, so pages can be processed in windows."""
+
+    def __init__(self, stage: OCRStage, pdf_document):
+        self.stage = stage
+        self.pdf_document = pdf_document
+        self.seen_xrefs = set()
+        self.seen_hashes = set()
+
+    def ocr_pages(self, page_indexes: Sequence[int], page_texts: List[str]) -> List[str]:
+        """Return the OCR text for every page, aligned with page_texts."""
+        stage = self.stage
+        # Per page, a list of either cached strings or pending futures
+        page_results: List[List] = [[] for _ in page_texts]
+
+        for position, (page_index, page_text) in enumerate(zip(page_indexes, page_texts)):
+            if len(page_text.strip()) >= stage.dense_text_chars:
+                continue
+
+            for img in self.pdf_document[page_index].get_images(full=True):
+                xref, width, height = img[0], img[2], img[3]
+                if xref in self.seen_xrefs or width * height < stage.min_image_area:
+                    continue
+                self.seen_xrefs.add(xref)
+
+                image_bytes = self.pdf_document.extract_image(xref)["image"]
+                image_hash = hashlib.sha256(image_bytes).hexdigest()
+                if image_hash in self.seen_hashes:
+                    continue
+                self.seen_hashes.add(image_hash)
+
+                cached = stage.cache.get(image_hash)
+                if cached is not None:
+                    page_results[position].append(cached)
+                    continue
+
+                future = stage.pool.submit(_ocr_image, image_bytes)
+                page_results[position].append((image_hash, future))
+
+        ocr_texts = []
+        for results in page_results:
+            page_ocr = []
+            for result in results:
+                if isinstance(result, tuple):
+                    image_hash, future = result
+                    text = future.result()
+                    stage.cache.put(image_hash, text)
+                    result = text
+                page_ocr.append(result)
+            ocr_texts.append("".join(page_ocr))
+        return ocr_texts
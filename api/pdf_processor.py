@@ -1,166 +1,713 @@
-# api/pdf_processor.py
-from PyPDF2 import PdfReader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
-from langchain_community.vectorstores import Qdrant
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains.question_answering import load_qa_chain
-from langchain.prompts import PromptTemplate
-import google.generativeai as genai
-import qdrant_client
-from qdrant_client.http import models
-import os
-import io
-import fitz
-import pytesseract
-from PIL import Image
-from typing import List
-from fastapi import UploadFile
-import uuid
-
-class PDFProcessor:
-    def __init__(self):
-        # Initialize configurations
-        self.GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-        self.QDRANT_URL = os.getenv("QDRANT_URL")
-        self.QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
-        
-        # Initialize clients and models
-        genai.configure(api_key=self.GOOGLE_API_KEY)
-        self.client = qdrant_client.QdrantClient(
-            url=self.QDRANT_URL,
-            api_key=self.QDRANT_API_KEY,
-        )
-        self.embed_model = HuggingFaceBgeEmbeddings(
-            model_name="BAAI/bge-large-en",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
-        self.model_name = "gemini-pro"
-
-    async def process_pdfs(self, files: List[UploadFile], collection_name: str):
-        # Extract text from PDFs
-        text, pdf_metadata = await self._get_pdf_text(files)
-        
-        # Create text chunks
-        chunks_with_metadata = self._get_text_chunks(text, pdf_metadata)
-        
-        # Store in vector database
-        await self._store_vectors(chunks_with_metadata, collection_name)
-
-    async def _get_pdf_text(self, files: List[UploadFile]):
-        text = ""
-        pdf_metadata = {}
-        
-        for file in files:
-            contents = await file.read()
-            pdf_text = ""
-            
-            # Process with PyPDF2
-            pdf_reader = PdfReader(io.BytesIO(contents))
-            pdf_document = fitz.open("pdf", contents)
-            
-            for page_index, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
-                pdf_text += page_text
-                
-                # Process images in PDF
-                pdf_page = pdf_document[page_index]
-                for img in pdf_page.get_images(full=True):
-                    xref = img[0]
-                    base_image = pdf_document.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image = Image.open(io.BytesIO(image_bytes))
-                    ocr_text = pytesseract.image_to_string(image)
-                    pdf_text += ocr_text
-            
-            text += pdf_text
-            pdf_metadata[file.filename] = pdf_text
-            
-        return text, pdf_metadata
-
-    def _get_text_chunks(self, text: str, metadata: dict):
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=100
-        )
-        chunks = text_splitter.split_text(text)
-        
-        chunks_with_metadata = []
-        for chunk in chunks:
-            for pdf_name, pdf_text in metadata.items():
-                if chunk in pdf_text:
-                    chunks_with_metadata.append({
-                        "text": chunk,
-                        "metadata": {
-                            "pdf_name": pdf_name,
-                            "chunk_id": str(uuid.uuid4())
-                        }
-                    })
-                    break
-        
-        return chunks_with_metadata
-
-    async def _store_vectors(self, chunks_with_metadata: List[dict], collection_name: str):
-        collections = self.client.get_collections().collections
-        collection_exists = any(c.name == collection_name for c in collections)
-        
-        if not collection_exists:
-            self.client.create_collection(
-                collection_name=collection_name,
-                vectors_config=models.VectorParams(
-                    size=len(self.embed_model.client.encode("test")),
-                    distance=models.Distance.COSINE
-                )
-            )
-        
-        texts = [chunk["text"] for chunk in chunks_with_metadata]
-        metadatas = [chunk["metadata"] for chunk in chunks_with_metadata]
-        
-        vector_store = Qdrant(
-            client=self.client,
-            collection_name=collection_name,
-            embeddings=self.embed_model
-        )
-        
-        vector_store.add_texts(texts=texts, metadatas=metadatas)
-
-    async def get_answer(self, question: str, collection_name: str) -> str:
-        vector_store = Qdrant(
-            client=self.client,
-            collection_name=collection_name,
-            embeddings=self.embed_model
-        )
-        
-        docs = vector_store.similarity_search(question)
-        chain = self._get_conversational_chain()
-        
-        response = chain(
-            {"input_documents": docs, "question": question},
-            return_only_outputs=True
-        )
-        
-        return response["output_text"]
-
-    def _get_conversational_chain(self):
-        prompt_template = """
-        Answer the question as detailed as possible from the provided context, make sure to provide all the details, if the answer is not in
-        provided context just say, "answer is not available in the context", don't provide the wrong answer\n\n
-        Context:\n {context}?\n
-        Question: \n{question}\n
-
-        Answer:
-        """
-
-        model = ChatGoogleGenerativeAI(
-            model=self.model_name,
-            temperature=0.3,
-            google_api_key=self.GOOGLE_API_KEY
-        )
-
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "question"]
-        )
-        
-        return load_qa_chain(model, chain_type="stuff", prompt=prompt)
\ No newline at end of file
+# api/pdf_processor.py
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain.chains.question_answering import load_qa_chain
+from langchain.prompts import PromptTemplate
+from langchain.schema import Document
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+import os
+import hashlib
+import logging
+import threading
+import time
+import asyncio
+import fitz
+from itertools import accumulate
+import numpy as np
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+import uuid
+from jobs import Job, JobError
+from ocr import OCRStage
+from embedding_cache import EmbeddingCache
+from embedding_service import EMBED_MODEL_NAME, BatchingEmbedder, load_embedding_model
+from embedding_server import RemoteEmbedder
+from vector_store import SearchResult, create_vector_store
+from context_packing import ContextPacker, estimate_tokens
+from answer_cache import AnswerCache
+from shared_state import get_shared_state
+from telemetry import get_telemetry
+from admission import AsyncPool, OverloadedError, backoff_delay, retry_with_backoff
+
+logger = logging.getLogger(__name__)
+
+# Payload fields that searches and deletes filter on
+INDEXED_FIELDS = ("user_id", "doc_hash", "pdf_name")
+
+# Namespace for deterministic chunk ids derived from the document hash, page and offset within the page
+CHUNK_ID_NAMESPACE = uuid.UUID("8f6f9c8e-5b0e-4b5e-9d43-2f1d3c6a7e10")
+
+PROMPT_TEMPLATE = """
+        Answer the question as detailed as possible from the provided context, make sure to provide all the details, if the answer is not in
+        provided context just say, "answer is not available in the context", don't provide the wrong answer\n\n
+        Context:\n {context}?\n
+        Question: \n{question}\n
+
+        Answer:
+        """
+
+class PageRecord(NamedTuple):
+    document: str
+    document_hash: str
+    page_number: int
+    page_hash: str
+    offset: int  # Character offset of the page within the document text
+    text: str
+
+class DocumentPlan(NamedTuple):
+    filename: str
+    path: str
+    document_hash: str
+    page_hashes: List[str]
+    page_indexes: List[int]  # Pages to extract, OCR, chunk and embed
+    page_chars: List[Optional[int]]  # Text length of each page; processed pages fill theirs in
+    reused: Dict[Tuple[str, int], int]  # (old doc_hash, old page_number) -> index of the page it becomes
+    old_doc_hashes: List[str]  # Earlier revisions this upload replaces
+
+def chunk_id(user_id: str, document_hash: str, page_number: int, start: int) -> str:
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{user_id}:{document_hash}:{page_number}:{start}"))
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def page_content_hash(pdf_document, page) -> str:
+    # Hashes the raw content stream and image streams, so it is cheap and needs no text extraction or OCR
+    digest = hashlib.sha256(page.read_contents())
+    for img in page.get_images(full=True):
+        digest.update(pdf_document.xref_stream_raw(img[0]) or b"")
+    return digest.hexdigest()
+
+def is_rate_limit_error(error: Optional[BaseException]) -> bool:
+    # Gemini reports rate limits and exhausted quota as 429 / RESOURCE_EXHAUSTED, possibly wrapped
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, google_exceptions.TooManyRequests):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+class PDFProcessor:
+    def __init__(self):
+        # Initialize configurations
+        self.GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+        
+        # Initialize clients and models
+        genai.configure(api_key=self.GOOGLE_API_KEY)
+        self.vector_store = create_vector_store()
+        self.telemetry = get_telemetry()
+        
+        # The embedding model is loaded on first use (or by warmup), not at import
+        self._embed_model = None
+        self._model_lock = threading.Lock()
+        embed_server_socket = os.getenv("EMBED_SERVER_SOCKET")
+        if embed_server_socket:
+            # Every worker shares one model hosted by embedding_server.py instead of loading its own
+            self.embedder = RemoteEmbedder(
+                embed_server_socket,
+                max_connections=int(os.getenv("EMBED_SERVER_CONNECTIONS", "8")),
+                timeout=float(os.getenv("EMBED_SERVER_TIMEOUT", "60"))
+            )
+        else:
+            self.embedder = BatchingEmbedder(
+                lambda: self.embed_model,
+                max_batch_size=int(os.getenv("EMBED_BATCH_SIZE", "32")),
+                max_wait_ms=float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+            )
+        self.model_name = "gemini-pro"
+        self._llm = None
+        self._chain = None
+        self.prompt = PromptTemplate(
+            template=PROMPT_TEMPLATE,
+            input_variables=["context", "question"]
+        )
+        
+        # Collections known to exist, with their vector dimension
+        self._collections: Dict[str, int] = {}
+        self.answer_cache = AnswerCache(
+            max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+            similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")),
+            state=get_shared_state()
+        )
+        self.ocr = OCRStage()
+        self.embedding_cache = EmbeddingCache(
+            os.getenv("EMBED_CACHE_PATH", "embedding_cache.db"),
+            model_name=EMBED_MODEL_NAME,
+            max_entries=int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+        )
+        
+        # Streaming ingestion settings
+        self.page_window = int(os.getenv("INGEST_PAGE_WINDOW", "16"))
+        self.batch_size = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=100,
+            add_start_index=True
+        )
+        
+        # Questions of one /ask/batch call that may be waiting on the LLM at once
+        self.batch_llm_concurrency = int(os.getenv("ASK_BATCH_LLM_CONCURRENCY", "8"))
+        
+        # Admission control: LLM calls and ingestion embedding batches each get a bounded pool,
+        # so bursts queue (or are turned away) instead of overloading the model or Gemini
+        self.llm_pool = AsyncPool(
+            "LLM",
+            limit=int(os.getenv("LLM_CONCURRENCY", "8")),
+            max_waiting=int(os.getenv("LLM_QUEUE_SIZE", "64")),
+            timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+        )
+        self.llm_retries = int(os.getenv("LLM_RETRIES", "3"))
+        self.llm_retry_base_delay = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+        self.llm_retry_max_delay = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+        self.embed_slots = threading.BoundedSemaphore(int(os.getenv("EMBED_CONCURRENCY", "1")))
+        
+        # Retrieval post-processing settings
+        self.context_fetch_k = int(os.getenv("CONTEXT_FETCH_K", "20"))
+        self.context_packer = ContextPacker(
+            max_chunks=int(os.getenv("CONTEXT_MAX_CHUNKS", "4")),
+            token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000")),
+            mmr_lambda=float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7")),
+            dedupe_threshold=float(os.getenv("CONTEXT_DEDUPE_THRESHOLD", "0.95"))
+        )
+
+    @property
+    def embed_model(self):
+        if self._embed_model is None:
+            with self._model_lock:
+                if self._embed_model is None:
+                    self._embed_model = load_embedding_model()
+        return self._embed_model
+
+    @property
+    def model_loaded(self) -> bool:
+        if isinstance(self.embedder, RemoteEmbedder):
+            return self.embedder.model_loaded()
+        return self._embed_model is not None
+
+    @property
+    def embedding_dimension(self) -> int:
+        if isinstance(self.embedder, RemoteEmbedder):
+            return self.embedder.dimension()
+        return self.embed_model.client.get_sentence_embedding_dimension()
+
+    def warmup(self):
+        # Load the model and run one query through it so the first request is not slow.
+        # It runs unattended at startup, so failures are logged; requests retry the load
+        try:
+            self.embedder.embed_query("warmup")
+            self._get_conversational_chain()
+        except Exception:
+            logger.exception("Model warmup failed")
+
+    def process_pdfs(self, files: List[Tuple[str, str, Optional[str]]], collection_name: str, user_id: str,
+                     job: Optional[Job] = None, completed: Optional[Set[str]] = None) -> dict:
+        # files are (filename, path, sha256) spooled to disk by the upload endpoint;
+        # a missing hash is computed from the file. completed holds the hashes of the
+        # user's fully ingested documents; without it, any stored point counts.
+        # This runs on an ingestion worker thread, never on the event loop.
+        self._ensure_collection(collection_name)
+        
+        # Documents the user already has are skipped entirely;
+        # new revisions of a document (same name) only reprocess changed pages
+        plans: List[DocumentPlan] = []
+        seen_hashes = set()
+        for filename, path, document_hash in files:
+            document_hash = document_hash or file_hash(path)
+            if document_hash in seen_hashes:
+                continue
+            if completed is not None:
+                if document_hash in completed:
+                    continue
+            elif self.vector_store.exists(collection_name, {"user_id": user_id, "doc_hash": document_hash}):
+                continue
+            seen_hashes.add(document_hash)
+            with self.telemetry.stage("ingest", "plan"):
+                try:
+                    plans.append(self._plan_revision(collection_name, user_id, filename, path, document_hash))
+                except fitz.FileDataError as e:
+                    raise JobError(f"{filename} could not be opened as a PDF") from e
+        
+        stats = {
+            "documents": [{"doc_hash": plan.document_hash, "pdf_name": plan.filename} for plan in plans],
+            "documents_replaced": [doc_hash for plan in plans for doc_hash in plan.old_doc_hashes],
+            "documents_skipped": len(files) - len(plans),
+            "pages_reused": sum(len(plan.reused) for plan in plans),
+            "pages_reprocessed": sum(len(plan.page_indexes) for plan in plans),
+            "embedding_cache_hits": 0,
+            "embedding_cache_misses": 0
+        }
+        if job:
+            # Known up front, so progress never runs ahead of the total
+            job.add_pages(stats["pages_reprocessed"])
+        
+        # Pages stream through chunking into bounded embedding batches, so
+        # memory scales with the batch size rather than the upload size
+        pages = self._iter_pages(plans, job)
+        try:
+            try:
+                for batch in self._iter_chunk_batches(pages, user_id):
+                    if job:
+                        job.set_stage("embedding")
+                    hits = self._store_vectors(batch, collection_name)
+                    stats["embedding_cache_hits"] += hits
+                    stats["embedding_cache_misses"] += len(batch) - hits
+                    if job:
+                        job.update_details(**stats)
+                
+                # Copy the chunks of unchanged pages over to the new revision
+                for plan in plans:
+                    self._carry_over(plan, collection_name, user_id)
+            except Exception:
+                # A half-ingested document must not linger in search results; old revisions are still intact
+                self._discard(plans, collection_name, user_id)
+                raise
+            
+            # Only now drop everything attached to the old revisions, in one delete each
+            for plan in plans:
+                if plan.old_doc_hashes:
+                    self.vector_store.delete(
+                        collection_name, {"user_id": user_id, "doc_hash": plan.old_doc_hashes}
+                    )
+        finally:
+            # Cached answers may no longer reflect the collection
+            if plans:
+                self.answer_cache.invalidate(self._cache_scope(collection_name, user_id))
+        
+        lookups = stats["embedding_cache_hits"] + stats["embedding_cache_misses"]
+        stats["embedding_cache_hit_ratio"] = stats["embedding_cache_hits"] / lookups if lookups else 0.0
+        if job:
+            job.update_details(**stats)
+        return stats
+
+    def _discard(self, plans: List[DocumentPlan], collection_name: str, user_id: str):
+        try:
+            self.vector_store.delete(
+                collection_name, {"user_id": user_id, "doc_hash": [plan.document_hash for plan in plans]}
+            )
+        except Exception:
+            logger.exception("Could not remove the points of a failed ingestion")
+
+    def _plan_revision(self, collection_name: str, user_id: str, filename: str, path: str,
+                       document_hash: str) -> DocumentPlan:
+        # Decides which pages need processing; when this upload replaces an earlier
+        # revision (same name), pages whose content is unchanged are kept from it
+        with fitz.open(path) as pdf_document:
+            page_hashes = [page_content_hash(pdf_document, page) for page in pdf_document]
+        page_chars: List[Optional[int]] = [None] * len(page_hashes)
+        
+        old_points = self.vector_store.scroll_metadata(collection_name, {"user_id": user_id, "pdf_name": filename})
+        # Leftovers of an earlier failed attempt at this same document are overwritten, not replaced
+        old_points = [m for m in old_points if m["doc_hash"] != document_hash]
+        if not old_points:
+            return DocumentPlan(filename, path, document_hash, page_hashes, list(range(len(page_hashes))),
+                                page_chars, {}, [])
+        
+        # Pages stored without their length can't be placed in the new revision's offsets and are reprocessed
+        old_pages: Dict[str, List[Tuple[str, int, int]]] = {}
+        for key in {(m.get("page_hash"), m["doc_hash"], m["page_number"], m.get("page_chars")) for m in old_points}:
+            if key[3] is not None:
+                old_pages.setdefault(key[0], []).append(key[1:])
+        
+        page_indexes, reused = [], {}
+        for page_index, page_hash in enumerate(page_hashes):
+            if old_pages.get(page_hash):
+                old_doc_hash, old_page_number, chars = old_pages[page_hash].pop()
+                reused[(old_doc_hash, old_page_number)] = page_index
+                page_chars[page_index] = chars
+            else:
+                page_indexes.append(page_index)
+        
+        old_doc_hashes = sorted({m["doc_hash"] for m in old_points})
+        return DocumentPlan(filename, path, document_hash, page_hashes, page_indexes, page_chars, reused, old_doc_hashes)
+
+    def _iter_pages(self, plans: List[DocumentPlan], job: Optional[Job] = None) -> Iterator[PageRecord]:
+        for plan in plans:
+            # Document offsets count kept pages too, by their stored lengths
+            offset, next_page = 0, 0
+            
+            # Each document is opened once; fitz provides both the text layer and the images
+            with fitz.open(plan.path) as pdf_document:
+                document_ocr = self.ocr.document(pdf_document)
+                
+                # Pages are read in small windows so OCR can still run in parallel
+                for start in range(0, len(plan.page_indexes), self.page_window):
+                    if job:
+                        job.set_stage("extracting")
+                    page_indexes = plan.page_indexes[start:start + self.page_window]
+                    with self.telemetry.stage("ingest", "extract") as span:
+                        page_texts = [pdf_document[i].get_text() for i in page_indexes]
+                        span.add(len(page_indexes))
+                    with self.telemetry.stage("ingest", "ocr") as span:
+                        ocr_texts = document_ocr.ocr_pages(page_indexes, page_texts)
+                        span.add(len(page_indexes))
+                    
+                    for page_index, page_text, ocr_text in zip(page_indexes, page_texts, ocr_texts):
+                        text = page_text + ocr_text
+                        offset += sum(plan.page_chars[next_page:page_index])
+                        plan.page_chars[page_index] = len(text)
+                        next_page = page_index + 1
+                        if job:
+                            job.advance()
+                        yield PageRecord(
+                            plan.filename, plan.document_hash, page_index + 1, plan.page_hashes[page_index], offset, text
+                        )
+                        offset += len(text)
+
+    def _carry_over(self, plan: DocumentPlan, collection_name: str, user_id: str):
+        # Copies the chunks of kept pages to the new revision with their text and vectors,
+        # re-keyed by the new document hash, page number and document offset
+        if not plan.reused:
+            return
+        page_starts = list(accumulate(plan.page_chars[:-1], initial=0))
+        old_doc_hashes = sorted({doc_hash for doc_hash, _ in plan.reused})
+        # One batch of old points is held at a time and written out before the next is read,
+        # so memory stays bounded by batch_size however large the document is
+        for points in self.vector_store.scroll_points(
+            collection_name, {"user_id": user_id, "doc_hash": old_doc_hashes}, batch_size=self.batch_size
+        ):
+            chunks = []
+            for point in points:
+                page_index = plan.reused.get((point.metadata["doc_hash"], point.metadata["page_number"]))
+                if page_index is None:
+                    continue
+                start = point.metadata["offset"] - point.metadata["page_start"]
+                chunks.append((
+                    chunk_id(user_id, plan.document_hash, page_index + 1, start),
+                    point.vector,
+                    point.text,
+                    {**point.metadata, "doc_hash": plan.document_hash, "page_number": page_index + 1,
+                     "page_start": page_starts[page_index], "offset": page_starts[page_index] + start}
+                ))
+            if not chunks:
+                continue
+            ids, vectors, texts, metadatas = zip(*chunks)
+            with self.telemetry.stage("ingest", "upsert") as span:
+                self.vector_store.upsert(collection_name, list(ids), list(vectors), list(texts), list(metadatas))
+                span.add(len(ids))
+
+    def _iter_chunk_batches(self, pages: Iterable[PageRecord], user_id: str) -> Iterator[List[dict]]:
+        batch = []
+        for page in pages:
+            with self.telemetry.stage("ingest", "chunk") as span:
+                chunks = self._get_text_chunks(page, user_id)
+                span.add(len(chunks))
+            batch.extend(chunks)
+            while len(batch) >= self.batch_size:
+                yield batch[:self.batch_size]
+                batch = batch[self.batch_size:]
+        if batch:
+            yield batch
+
+    def _get_text_chunks(self, page: PageRecord, user_id: str):
+        # Chunks never cross a page, so provenance is known by construction
+        chunks_with_metadata = []
+        for chunk in self.text_splitter.create_documents([page.text]):
+            start = chunk.metadata["start_index"]
+            chunks_with_metadata.append({
+                "text": chunk.page_content,
+                "id": chunk_id(user_id, page.document_hash, page.page_number, start),
+                "metadata": {
+                    "user_id": user_id,
+                    "pdf_name": page.document,
+                    "doc_hash": page.document_hash,
+                    "page_number": page.page_number,
+                    "page_hash": page.page_hash,
+                    "page_start": page.offset,
+                    "page_chars": len(page.text),
+                    "offset": page.offset + start
+                }
+            })
+        
+        return chunks_with_metadata
+
+    def _ensure_collection(self, collection_name: str):
+        if collection_name not in self._collections:
+            dimension = self.embedding_dimension
+            self.vector_store.ensure_collection(collection_name, dimension, indexed_fields=INDEXED_FIELDS)
+            self._collections[collection_name] = dimension
+
+    def _embed_documents(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        # Look vectors up by content first and only run the model on misses
+        keys = [self.embedding_cache.key(text) for text in texts]
+        cached = self.embedding_cache.get_many(list(set(keys)))
+        
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        if missing:
+            # Bounded so ingestion can't flood the embedder and starve query embeddings
+            with self.embed_slots:
+                vectors = self.embedder.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), (np.asarray(v, dtype=np.float32) for v in vectors)))
+            self.embedding_cache.put_many(computed)
+            cached.update(computed)
+        
+        hits = sum(1 for key in keys if key not in missing)
+        return [cached[key].tolist() for key in keys], hits
+
+    def _store_vectors(self, chunks_with_metadata: List[dict], collection_name: str) -> int:
+        texts = [chunk["text"] for chunk in chunks_with_metadata]
+        with self.telemetry.stage("ingest", "embed") as span:
+            vectors, cache_hits = self._embed_documents(texts)
+            span.add(len(texts))
+        
+        with self.telemetry.stage("ingest", "upsert") as span:
+            self.vector_store.upsert(
+                collection_name,
+                ids=[chunk["id"] for chunk in chunks_with_metadata],
+                vectors=vectors,
+                texts=texts,
+                metadatas=[chunk["metadata"] for chunk in chunks_with_metadata]
+            )
+            span.add(len(texts))
+        return cache_hits
+
+    def delete_documents(self, collection_name: str, user_id: str, doc_hashes: Optional[List[str]] = None):
+        # Removes the points of the given documents (or all of the user's) in one request
+        self._ensure_collection(collection_name)
+        payload_filter = {"user_id": user_id}
+        if doc_hashes is not None:
+            payload_filter["doc_hash"] = doc_hashes
+        self.vector_store.delete(collection_name, payload_filter)
+        self.answer_cache.invalidate(self._cache_scope(collection_name, user_id))
+
+    @staticmethod
+    def _cache_scope(collection_name: str, user_id: str) -> str:
+        return f"{collection_name}/{user_id}"
+
+    @staticmethod
+    def _search_filter(user_id: str, documents: Optional[List[str]]) -> dict:
+        payload_filter = {"user_id": user_id}
+        if documents:
+            payload_filter["doc_hash"] = documents
+        return payload_filter
+
+    async def _retrieve(self, question: str, query_vector: List[float], collection_name: str, user_id: str,
+                        documents: Optional[List[str]]) -> List[SearchResult]:
+        # Over-fetch, then dedupe, diversify, merge and budget the chunks before the LLM sees them.
+        # The search is a blocking call (HTTP to Qdrant, or a local scan), so it runs off the event loop
+        with self.telemetry.stage("ask", "search") as span:
+            candidates = await asyncio.to_thread(
+                self.vector_store.search, collection_name, query_vector, k=self.context_fetch_k,
+                payload_filter=self._search_filter(user_id, documents), with_vectors=True
+            )
+            span.add(len(candidates))
+        return self._pack(question, query_vector, candidates)
+
+    def _pack(self, question: str, query_vector: List[float], candidates: List[SearchResult]) -> List[SearchResult]:
+        with self.telemetry.stage("ask", "pack") as span:
+            packed = self.context_packer.pack(query_vector, candidates)
+            span.add(len(packed))
+        
+        candidate_tokens = sum(estimate_tokens(r.text) for r in candidates)
+        packed_tokens = sum(estimate_tokens(r.text) for r in packed)
+        prompt_tokens = estimate_tokens(self.prompt.format(context="", question=question)) + packed_tokens
+        logger.info("Context packing: %d candidates (%d tokens) -> %d chunks (%d tokens), prompt tokens %d",
+                    len(candidates), candidate_tokens, len(packed), packed_tokens, prompt_tokens)
+        return packed
+
+    async def get_answer(self, question: str, collection_name: str, user_id: str,
+                         documents: Optional[List[str]] = None) -> dict:
+        scope = self._cache_scope(collection_name, user_id)
+        variant = ",".join(sorted(documents or []))
+        version = self.answer_cache.version(scope)
+        answer = self.answer_cache.get_exact(scope, question, variant)
+        if answer is not None:
+            return {"answer": answer, "cached": True}
+        
+        with self.telemetry.stage("ask", "embed"):
+            query_vector = await self.embedder.aembed_query(question)
+        answer = self.answer_cache.get_similar(scope, query_vector, variant)
+        if answer is not None:
+            return {"answer": answer, "cached": True}
+        
+        results = await self._retrieve(question, query_vector, collection_name, user_id, documents)
+        answer = await self._generate(question, results)
+        self.answer_cache.put(scope, question, query_vector, answer, version, variant)
+        return {"answer": answer, "cached": False}
+
+    async def get_answers(self, questions: List[str], collection_name: str, user_id: str,
+                          documents: Optional[List[str]] = None) -> AsyncIterator[Tuple[int, dict]]:
+        # Yields (index, result) as each answer is ready. All questions are embedded in one
+        # batch and searched in one request; LLM calls run concurrently up to
+        # batch_llm_concurrency. A failed question yields {"error": ...} instead of raising.
+        scope = self._cache_scope(collection_name, user_id)
+        variant = ",".join(sorted(documents or []))
+        version = self.answer_cache.version(scope)
+        
+        pending = []
+        for index, question in enumerate(questions):
+            answer = self.answer_cache.get_exact(scope, question, variant)
+            if answer is not None:
+                yield index, {"answer": answer, "cached": True}
+            else:
+                pending.append(index)
+        if not pending:
+            return
+        
+        try:
+            with self.telemetry.stage("ask", "embed") as span:
+                vectors = await self.embedder.aembed_queries([questions[i] for i in pending])
+                span.add(len(pending))
+        except Exception as e:
+            for index in pending:
+                yield index, {"error": str(e)}
+            return
+        
+        uncached = []
+        for index, vector in zip(pending, vectors):
+            answer = self.answer_cache.get_similar(scope, vector, variant)
+            if answer is not None:
+                yield index, {"answer": answer, "cached": True}
+            else:
+                uncached.append((index, vector))
+        if not uncached:
+            return
+        
+        try:
+            with self.telemetry.stage("ask", "search") as span:
+                candidate_lists = await asyncio.to_thread(
+                    self.vector_store.search_batch, collection_name, [vector for _, vector in uncached],
+                    k=self.context_fetch_k, payload_filter=self._search_filter(user_id, documents), with_vectors=True
+                )
+                span.add(sum(len(candidates) for candidates in candidate_lists))
+        except Exception as e:
+            for index, _ in uncached:
+                yield index, {"error": str(e)}
+            return
+        
+        semaphore = asyncio.Semaphore(self.batch_llm_concurrency)
+        
+        async def answer_one(index: int, vector: List[float], candidates: List[SearchResult]) -> Tuple[int, dict]:
+            try:
+                results = self._pack(questions[index], vector, candidates)
+                async with semaphore:
+                    answer = await self._generate(questions[index], results)
+            except OverloadedError as e:
+                return index, {"error": str(e), "retry_after": e.retry_after}
+            except Exception as e:
+                return index, {"error": str(e)}
+            self.answer_cache.put(scope, questions[index], vector, answer, version, variant)
+            return index, {"answer": answer, "cached": False}
+        
+        tasks = [
+            asyncio.ensure_future(answer_one(index, vector, candidates))
+            for (index, vector), candidates in zip(uncached, candidate_lists)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # The caller stopped reading (e.g. the client disconnected); drop the remaining calls
+            for task in tasks:
+                task.cancel()
+
+    async def _generate(self, question: str, results: List[SearchResult]) -> str:
+        docs = [Document(page_content=r.text, metadata=r.metadata) for r in results]
+        chain = self._get_conversational_chain()
+        
+        async def call():
+            # The pool slot is released while backing off, so waiting callers can use it
+            async with self.llm_pool.slot():
+                with self.telemetry.stage("ask", "llm"):
+                    return await chain.acall(
+                        {"input_documents": docs, "question": question},
+                        return_only_outputs=True
+                    )
+        
+        try:
+            response = await retry_with_backoff(
+                call, is_rate_limit_error, attempts=self.llm_retries + 1,
+                base_delay=self.llm_retry_base_delay, max_delay=self.llm_retry_max_delay
+            )
+        except Exception as e:
+            if is_rate_limit_error(e):
+                raise OverloadedError("The LLM is rate limited", self.llm_retry_max_delay) from e
+            raise
+        return response["output_text"]
+
+    async def stream_answer(self, question: str, collection_name: str, user_id: str,
+                            documents: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, dict]]:
+        # Yields (event, data) pairs: retrieval results, LLM tokens, then the final sources
+        started = time.perf_counter()
+        scope = self._cache_scope(collection_name, user_id)
+        variant = ",".join(sorted(documents or []))
+        version = self.answer_cache.version(scope)
+        answer = self.answer_cache.get_exact(scope, question, variant)
+        if answer is None:
+            with self.telemetry.stage("ask", "embed"):
+                query_vector = await self.embedder.aembed_query(question)
+            answer = self.answer_cache.get_similar(scope, query_vector, variant)
+        if answer is not None:
+            time_to_first_token = time.perf_counter() - started
+            self.telemetry.observe_first_token(time_to_first_token, cached=True)
+            yield "token", {"text": answer}
+            yield "done", {"cached": True, "sources": [], "time_to_first_token": time_to_first_token}
+            return
+        
+        results = await self._retrieve(question, query_vector, collection_name, user_id, documents)
+        yield "retrieval", {"sources": [self._source(r) for r in results]}
+        
+        prompt = self.prompt.format(
+            context="\n\n".join(r.text for r in results),
+            question=question
+        )
+        parts = []
+        time_to_first_token = None
+        for attempt in range(self.llm_retries + 1):
+            try:
+                async with self.llm_pool.slot():
+                    with self.telemetry.stage("ask", "llm") as span:
+                        async for chunk in self._get_llm().astream(prompt):
+                            if time_to_first_token is None:
+                                time_to_first_token = time.perf_counter() - started
+                                self.telemetry.observe_first_token(time_to_first_token, cached=False)
+                            parts.append(chunk.content)
+                            span.add()
+                            yield "token", {"text": chunk.content}
+                break
+            except Exception as e:
+                # Only a stream that has not produced anything yet can be retried
+                if parts or not is_rate_limit_error(e):
+                    raise
+                if attempt == self.llm_retries:
+                    raise OverloadedError("The LLM is rate limited", self.llm_retry_max_delay) from e
+                await asyncio.sleep(backoff_delay(attempt, self.llm_retry_base_delay, self.llm_retry_max_delay))
+        
+        self.answer_cache.put(scope, question, query_vector, "".join(parts), version, variant)
+        logger.info("Streamed answer: time to first token %.3fs, total %.3fs",
+                    time_to_first_token or 0.0, time.perf_counter() - started)
+        yield "done", {
+            "cached": False,
+            "sources": [dict(self._source(r), text=r.text) for r in results],
+            "time_to_first_token": time_to_first_token
+        }
+
+    @staticmethod
+    def _source(result) -> dict:
+        return {
+            "pdf_name": result.metadata.get("pdf_name"),
+            "doc_hash": result.metadata.get("doc_hash"),
+            "page_number": result.metadata.get("page_number"),
+            "score": result.score
+        }
+
+    def _get_llm(self):
+        if self._llm is None:
+            self._llm = ChatGoogleGenerativeAI(
+                model=self.model_name,
+                temperature=0.3,
+                google_api_key=self.GOOGLE_API_KEY
+            )
+        return self._llm
+
+    def _get_conversational_chain(self):
+        if self._chain is None:
+            self._chain = load_qa_chain(self._get_llm(), chain_type="stuff", prompt=self.prompt)
+        return self._chain
\ No newline at end of file
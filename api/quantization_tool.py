@@ -0,0 +1,124 @@
+# api/quantization_tool.py
+"""Migrate a collection between quantization modes, or measure what quantization costs.
+
+    python quantization_tool.py migrate --collection default --mode int8
+    python quantization_tool.py report --collection default --queries questions.txt --output report.json
+
+The report runs a fixed query set against the collection twice: once as an
+exact full-precision search (the ground truth), and once through the
+collection's index (quantized or not) at each oversampling factor. It
+reports recall@k and latency percentiles for each.
+"""
+import argparse
+import json
+import time
+from typing import List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from pdf_processor import PDFProcessor
+from vector_store import QUANTIZATION_MODES
+
+DEFAULT_QUERIES = [
+    "What is the refund policy?",
+    "How do I reset my password?",
+    "What are the system requirements?",
+    "Who should I contact for support?",
+    "What is covered by the warranty?",
+    "How is personal data stored and protected?",
+    "What are the installation steps?",
+    "What happens if a payment fails?",
+    "How long does shipping take?",
+    "What are the safety instructions?",
+]
+
+
+def _percentiles(latencies: List[float]) -> dict:
+    values = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def migrate(processor: PDFProcessor, args):
+    started = time.perf_counter()
+    processor.vector_store.set_quantization(args.collection, args.mode)
+    print(f"Migrated {args.collection} to {args.mode} in {time.perf_counter() - started:.1f}s")
+
+
+def report(processor: PDFProcessor, args):
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    payload_filter = {"user_id": args.user_id} if args.user_id else None
+    store = processor.vector_store
+    mode = store.get_quantization(args.collection)
+    vectors = [processor.embedder.embed_query(query) for query in queries]
+
+    def run(**search_kwargs):
+        results, latencies = [], []
+        for vector in vectors:
+            started = time.perf_counter()
+            hits = store.search(args.collection, vector, k=args.k, payload_filter=payload_filter, **search_kwargs)
+            latencies.append(time.perf_counter() - started)
+            results.append([hit.id for hit in hits])
+        return results, latencies
+
+    # Warm both paths once so the first timed query doesn't pay for page faults
+    run(exact=True)
+    truth, latencies = run(exact=True)
+    rows = [dict(mode="full precision (exact)", oversampling=None, recall=1.0, **_percentiles(latencies))]
+
+    for oversampling in args.oversampling:
+        results, latencies = run(oversampling=oversampling)
+        recall = np.mean([
+            len(set(found) & set(expected)) / max(len(expected), 1)
+            for found, expected in zip(results, truth)
+        ])
+        rows.append(dict(mode=mode, oversampling=oversampling, recall=float(recall), **_percentiles(latencies)))
+
+    print(f"{'mode':<24}{'oversampling':>14}{'recall@' + str(args.k):>12}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in rows:
+        oversampling = "-" if row["oversampling"] is None else f"{row['oversampling']:g}"
+        print(f"{row['mode']:<24}{oversampling:>14}{row['recall']:>12.3f}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"collection": args.collection, "quantization": mode, "k": args.k, "queries": len(queries),
+                       "results": rows}, f, indent=2)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="Change a collection's quantization mode")
+    migrate_parser.add_argument("--collection", default="default")
+    migrate_parser.add_argument("--mode", choices=QUANTIZATION_MODES, required=True)
+
+    report_parser = subparsers.add_parser("report", help="Recall and latency of indexed vs exact full-precision search")
+    report_parser.add_argument("--collection", default="default")
+    report_parser.add_argument("--queries", help="File with one question per line")
+    report_parser.add_argument("--user-id", help="Only search this user's documents")
+    report_parser.add_argument("--k", type=int, default=10)
+    report_parser.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 2.0, 4.0])
+    report_parser.add_argument("--output", help="Write the report as JSON to this path")
+
+    args = parser.parse_args()
+    processor = PDFProcessor()
+    try:
+        if args.command == "migrate":
+            migrate(processor, args)
+        else:
+            report(processor, args)
+    finally:
+        processor.embedder.shutdown()
+
+
+if __name__ == "__main__":
+    main()
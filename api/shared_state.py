@@ -0,0 +1,60 @@
+# api/shared_state.py
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+
+class SharedState:
+    """A SQLite file for the state every API worker has to agree on.
+
+    Job status, answer-cache versions and rate-limit buckets are kept here
+    instead of in each worker's memory, so with several workers any of them
+    can report a job another one runs, an upload invalidates cached answers
+    everywhere, and a user's rate limit doesn't multiply with the worker
+    count. Each thread gets its own connection; in WAL mode reads never wait
+    for a writer.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; read-modify-write callers open a transaction()
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't both read the old value
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+_shared_state: Optional[SharedState] = None
+_shared_state_lock = threading.Lock()
+
+def get_shared_state() -> Optional[SharedState]:
+    # One per process; SHARED_STATE_PATH="" keeps this state in process memory, for a single worker only
+    global _shared_state
+    path = os.getenv("SHARED_STATE_PATH", "shared_state.db")
+    if not path:
+        return None
+    with _shared_state_lock:
+        if _shared_state is None:
+            _shared_state = SharedState(path)
+        return _shared_state
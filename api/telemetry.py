@@ -0,0 +1,202 @@
+# api/telemetry.py
+import logging
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+# The id of the request (or ingestion job) being served; set by RequestContextMiddleware
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds request_id to every record so log formats can include %(request_id)s."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or "-"
+        return True
+
+
+def configure_logging(level: str = "INFO"):
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s")
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(RequestIdFilter())
+
+
+class _Stage:
+    __slots__ = ("telemetry", "pipeline", "stage", "items", "started")
+
+    def __init__(self, telemetry: "Telemetry", pipeline: str, stage: str):
+        self.telemetry = telemetry
+        self.pipeline = pipeline
+        self.stage = stage
+        self.items = 0
+
+    def add(self, count: int = 1):
+        self.items += count
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Only real errors count; GeneratorExit/CancelledError mean the caller went away
+        failed = exc_type is not None and issubclass(exc_type, Exception)
+        self.telemetry._finish(self, time.perf_counter() - self.started, failed)
+        return False
+
+
+class _NoopStage:
+    def add(self, count: int = 1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+class Telemetry:
+    """Prometheus metrics and log-based trace spans for pipeline stages.
+
+    `with telemetry.stage("ingest", "embed") as span: ...; span.add(n)`
+    observes the stage's duration in a histogram and counts the items it
+    handled. With tracing on, every stage also logs a span line carrying
+    the current request id. With both off (or prometheus_client missing),
+    stage() hands back a shared no-op object and costs next to nothing.
+    """
+
+    def __init__(self, metrics_enabled: bool = True, tracing_enabled: bool = False):
+        self.metrics_enabled = metrics_enabled and prometheus_client is not None
+        self.tracing_enabled = tracing_enabled
+        if metrics_enabled and prometheus_client is None:
+            logger.warning("METRICS_ENABLED is set but prometheus_client is not installed; metrics are off")
+        if self.metrics_enabled:
+            self.stage_seconds = prometheus_client.Histogram(
+                "pdf_chat_stage_seconds", "Time spent in each pipeline stage",
+                ["pipeline", "stage"], buckets=STAGE_BUCKETS
+            )
+            self.stage_items = prometheus_client.Counter(
+                "pdf_chat_stage_items_total", "Items (pages, chunks, texts, points) handled by each stage",
+                ["pipeline", "stage"]
+            )
+            self.stage_errors = prometheus_client.Counter(
+                "pdf_chat_stage_errors_total", "Pipeline stage calls that raised", ["pipeline", "stage"]
+            )
+            self.request_seconds = prometheus_client.Histogram(
+                "pdf_chat_http_request_seconds", "HTTP request latency", ["method", "route", "status"],
+                buckets=STAGE_BUCKETS
+            )
+            self.first_token_seconds = prometheus_client.Histogram(
+                "pdf_chat_time_to_first_token_seconds", "Time from a streamed question to its first answer token",
+                ["cached"], buckets=STAGE_BUCKETS
+            )
+
+    @property
+    def enabled(self) -> bool:
+        return self.metrics_enabled or self.tracing_enabled
+
+    def stage(self, pipeline: str, stage: str):
+        if not self.enabled:
+            return _NOOP_STAGE
+        return _Stage(self, pipeline, stage)
+
+    def _finish(self, span: _Stage, seconds: float, failed: bool):
+        if self.metrics_enabled:
+            self.stage_seconds.labels(span.pipeline, span.stage).observe(seconds)
+            if span.items:
+                self.stage_items.labels(span.pipeline, span.stage).inc(span.items)
+            if failed:
+                self.stage_errors.labels(span.pipeline, span.stage).inc()
+        if self.tracing_enabled:
+            logger.info("span %s.%s %.1fms items=%d%s", span.pipeline, span.stage, seconds * 1000,
+                        span.items, " error" if failed else "")
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        if self.metrics_enabled:
+            self.request_seconds.labels(method, route, str(status)).observe(seconds)
+        if self.tracing_enabled:
+            logger.info("request %s %s %d %.1fms", method, route, status, seconds * 1000)
+
+    def observe_first_token(self, seconds: float, cached: bool):
+        if self.metrics_enabled:
+            self.first_token_seconds.labels("true" if cached else "false").observe(seconds)
+        if self.tracing_enabled:
+            logger.info("first token %.1fms cached=%s", seconds * 1000, cached)
+
+    def render(self) -> bytes:
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            # Every worker writes its samples to that directory; sum them so /metrics covers all workers
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return prometheus_client.generate_latest(registry)
+        return prometheus_client.generate_latest()
+
+    @property
+    def content_type(self) -> str:
+        return prometheus_client.CONTENT_TYPE_LATEST
+
+
+class RequestContextMiddleware:
+    """ASGI middleware that gives each request an id (X-Request-Id, generated if absent) and times it."""
+
+    def __init__(self, app, telemetry: "Telemetry"):
+        self.app = app
+        self.telemetry = telemetry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1") or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if self.telemetry.enabled:
+                # The route template keeps label cardinality bounded (/jobs/{job_id}, not every id)
+                route = getattr(scope.get("route"), "path", "unmatched")
+                self.telemetry.observe_request(scope["method"], route, status, time.perf_counter() - started)
+            request_id_var.reset(token)
+
+
+_telemetry: Optional[Telemetry] = None
+_telemetry_lock = threading.Lock()
+
+def get_telemetry() -> Telemetry:
+    # One process-wide instance, since Prometheus metrics can only be registered once
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry(
+                metrics_enabled=os.getenv("METRICS_ENABLED", "1") == "1",
+                tracing_enabled=os.getenv("TRACING_ENABLED", "0") == "1"
+            )
+        return _telemetry
@@ -0,0 +1,166 @@
+# api/uploads.py
+import hashlib
+import os
+from typing import List, NamedTuple, Optional
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class InvalidUploadError(Exception):
+    pass
+
+
+class SpooledUpload(NamedTuple):
+    filename: str
+    path: str
+    sha256: str
+    size: int
+
+
+class _Part:
+    def __init__(self):
+        self.headers = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.field_name: Optional[str] = None
+        self.filename: Optional[str] = None
+        self.out = None
+        self.path: Optional[str] = None
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.pending = bytearray()
+        self.ended = False
+
+
+class UploadSpooler:
+    """Streams a multipart upload straight to files in a spool directory.
+
+    The request body is read chunk by chunk and never held in memory as a
+    whole: each file part is written to disk in block_size writes while its
+    SHA-256 is computed on the fly. A file over max_file_bytes, or a body
+    over max_request_bytes, aborts the upload as soon as the limit is
+    crossed (or before reading anything, if Content-Length already says so).
+    """
+
+    def __init__(self, max_file_bytes: int, max_request_bytes: int, block_size: int = 1 << 20,
+                 field_name: str = "files"):
+        self.max_file_bytes = max_file_bytes
+        self.max_request_bytes = max_request_bytes
+        self.block_size = block_size
+        self.field_name = field_name
+
+    async def spool(self, request: Request, spool_path: str) -> List[SpooledUpload]:
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise InvalidUploadError("Expected a multipart/form-data upload")
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_request_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {self.max_request_bytes} byte request limit")
+
+        uploads: List[SpooledUpload] = []
+        parts: List[_Part] = []
+        errors: List[Exception] = []
+        complete: List[bool] = []
+
+        def on_part_begin():
+            parts.append(_Part())
+
+        def on_header_field(data: bytes, start: int, end: int):
+            parts[-1].header_field += data[start:end]
+
+        def on_header_value(data: bytes, start: int, end: int):
+            parts[-1].header_value += data[start:end]
+
+        def on_header_end():
+            part = parts[-1]
+            part.headers[part.header_field.lower()] = part.header_value
+            part.header_field, part.header_value = b"", b""
+
+        def on_headers_finished():
+            part = parts[-1]
+            _, options = parse_options_header(part.headers.get(b"content-disposition", b""))
+            part.field_name = options.get(b"name", b"").decode("utf-8", "replace")
+            filename = options.get(b"filename")
+            if part.field_name == self.field_name and filename:
+                part.filename = os.path.basename(filename.decode("utf-8", "replace"))
+                part.path = os.path.join(spool_path, f"{len(parts) - 1}.pdf")
+                part.out = open(part.path, "wb")
+
+        def on_part_data(data: bytes, start: int, end: int):
+            part = parts[-1]
+            if part.out is None:
+                return
+            part.size += end - start
+            if part.size > self.max_file_bytes:
+                errors.append(UploadTooLargeError(
+                    f"{part.filename} exceeds the {self.max_file_bytes} byte per-file limit"
+                ))
+                return
+            chunk = data[start:end]
+            part.digest.update(chunk)
+            part.pending += chunk
+
+        def on_part_end():
+            part = parts[-1]
+            part.ended = True
+            if part.out is not None and not errors:
+                uploads.append(SpooledUpload(part.filename, part.path, part.digest.hexdigest(), part.size))
+
+        def on_end():
+            complete.append(True)
+
+        parser = MultipartParser(boundary, {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+            "on_end": on_end,
+        })
+
+        received = 0
+        try:
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > self.max_request_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds the {self.max_request_bytes} byte request limit")
+                parser.write(chunk)
+                if errors:
+                    raise errors[0]
+                # Data goes to disk in whole blocks; a part's tail is written once the part ends
+                for part in parts:
+                    if part.out is not None and not part.out.closed and (
+                            part.ended or len(part.pending) >= self.block_size):
+                        await self._flush(part)
+                        if part.ended:
+                            part.out.close()
+            parser.finalize()
+            # A body cut off before the closing boundary would otherwise drop its open part silently
+            if not complete:
+                raise InvalidUploadError("Upload ended before the closing multipart boundary")
+            for part in parts:
+                if part.out is not None and not part.out.closed:
+                    await self._flush(part)
+        finally:
+            for part in parts:
+                if part.out is not None:
+                    part.out.close()
+
+        if not uploads:
+            raise InvalidUploadError(f"No files were uploaded in the '{self.field_name}' field")
+        return uploads
+
+    @staticmethod
+    async def _flush(part: _Part):
+        if part.pending:
+            data, part.pending = bytes(part.pending), bytearray()
+            await run_in_threadpool(part.out.write, data)
@@ -0,0 +1,757 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import qdrant_client
+from qdrant_client.http import models
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+
+# Bits set in each byte value, for Hamming distances over packed binary vectors
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+# Rows scanned (or re-encoded) at a time, so temporaries stay a fixed size regardless of collection size
+SCAN_BLOCK_ROWS = 8192
+
+# Metadata equality filter: {"doc_hash": "..."} or {"doc_hash": ["...", "..."]} to match any
+PayloadFilter = Dict[str, Any]
+
+
+class SearchResult(NamedTuple):
+    id: str
+    score: float
+    text: str
+    metadata: Dict[str, Any]
+    vector: Optional[List[float]] = None
+
+
+class VectorStore(ABC):
+    """Storage backend for chunk vectors and their payloads."""
+
+    @abstractmethod
+    def ensure_collection(self, collection_name: str, dimension: int, indexed_fields: Sequence[str] = ()):
+        """Create the collection if needed, with payload indexes on indexed_fields."""
+
+    @abstractmethod
+    def upsert(self, collection_name: str, ids: List[str], vectors: List[List[float]],
+               texts: List[str], metadatas: List[dict]):
+        pass
+
+    @abstractmethod
+    def search(self, collection_name: str, vector: List[float], k: int = 4,
+               payload_filter: Optional[PayloadFilter] = None, with_vectors: bool = False,
+               exact: bool = False, oversampling: Optional[float] = None) -> List[SearchResult]:
+        """Top-k search. On quantized collections, k * oversampling candidates are
+        found on the quantized vectors and rescored against the originals; exact
+        skips quantization and any approximate index entirely."""
+
+    def search_batch(self, collection_name: str, vectors: List[List[float]], k: int = 4,
+                     payload_filter: Optional[PayloadFilter] = None, with_vectors: bool = False,
+                     exact: bool = False, oversampling: Optional[float] = None) -> List[List[SearchResult]]:
+        """search() for several query vectors sharing one filter; backends answer them in one pass."""
+        return [
+            self.search(collection_name, vector, k, payload_filter, with_vectors, exact, oversampling)
+            for vector in vectors
+        ]
+
+    @abstractmethod
+    def set_quantization(self, collection_name: str, quantization: str):
+        """Migrate an existing collection to another quantization mode."""
+
+    @abstractmethod
+    def get_quantization(self, collection_name: str) -> str:
+        """The collection's current quantization mode ("none" if it isn't quantized)."""
+
+    @abstractmethod
+    def exists(self, collection_name: str, payload_filter: PayloadFilter) -> bool:
+        pass
+
+    @abstractmethod
+    def delete(self, collection_name: str, payload_filter: PayloadFilter):
+        pass
+
+    @abstractmethod
+    def scroll_metadata(self, collection_name: str, payload_filter: PayloadFilter) -> List[Dict[str, Any]]:
+        """Metadata of every point matching the filter, without vectors."""
+
+    @abstractmethod
+    def scroll_points(self, collection_name: str, payload_filter: PayloadFilter,
+                      batch_size: int = 256) -> Iterator[List[SearchResult]]:
+        """Points matching the filter, with their vectors (scores are 0), in pages of up to batch_size."""
+
+
+class QdrantVectorStore(VectorStore):
+    """Remote Qdrant backend. Payloads use langchain's page_content/metadata layout.
+
+    New collections use the store's quantization mode; quantized collections
+    keep their original vectors on disk and the quantized ones in RAM.
+    """
+
+    def __init__(self, url: str, api_key: Optional[str] = None, quantization: str = "none",
+                 oversampling: float = 2.0):
+        # QDRANT_URL=":memory:" runs an in-process instance (used by the benchmark)
+        self.client = qdrant_client.QdrantClient(location=url, api_key=api_key)
+        self.quantization = quantization
+        self.oversampling = oversampling
+
+    @staticmethod
+    def _quantization_config(quantization: str):
+        if quantization == "int8":
+            return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=0.99, always_ram=True
+            ))
+        if quantization == "binary":
+            return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+        if quantization == "none":
+            return None
+        raise ValueError(f"Unknown quantization mode: {quantization}")
+
+    def ensure_collection(self, collection_name: str, dimension: int, indexed_fields: Sequence[str] = ()):
+        collections = self.client.get_collections().collections
+        if not any(c.name == collection_name for c in collections):
+            self.client.create_collection(
+                collection_name=collection_name,
+                vectors_config=models.VectorParams(
+                    size=dimension,
+                    distance=models.Distance.COSINE,
+                    on_disk=self.quantization != "none"
+                ),
+                quantization_config=self._quantization_config(self.quantization)
+            )
+        # Creating an index that already exists is a no-op
+        for field in indexed_fields:
+            self.client.create_payload_index(
+                collection_name=collection_name,
+                field_name=f"metadata.{field}",
+                field_schema=models.PayloadSchemaType.KEYWORD
+            )
+
+    def upsert(self, collection_name, ids, vectors, texts, metadatas):
+        self.client.upsert(
+            collection_name=collection_name,
+            points=[
+                models.PointStruct(
+                    id=point_id,
+                    vector=vector,
+                    payload={"page_content": text, "metadata": metadata}
+                )
+                for point_id, vector, text, metadata in zip(ids, vectors, texts, metadatas)
+            ]
+        )
+
+    def set_quantization(self, collection_name, quantization):
+        config = self._quantization_config(quantization)
+        self.client.update_collection(
+            collection_name=collection_name,
+            vectors_config={"": models.VectorParamsDiff(on_disk=config is not None)},
+            quantization_config=config or models.Disabled.DISABLED
+        )
+
+    def get_quantization(self, collection_name):
+        config = self.client.get_collection(collection_name).config.quantization_config
+        if isinstance(config, models.ScalarQuantization):
+            return "int8"
+        if isinstance(config, models.BinaryQuantization):
+            return "binary"
+        if isinstance(config, models.ProductQuantization):
+            return "product"
+        return "none"
+
+    def _search_params(self, exact, oversampling):
+        return models.SearchParams(
+            exact=exact,
+            quantization=models.QuantizationSearchParams(
+                ignore=exact,
+                rescore=True,
+                oversampling=oversampling or self.oversampling
+            )
+        )
+
+    @staticmethod
+    def _results(points, with_vectors) -> List[SearchResult]:
+        return [
+            SearchResult(
+                id=str(point.id),
+                score=point.score,
+                text=point.payload.get("page_content", ""),
+                metadata=point.payload.get("metadata", {}),
+                vector=point.vector if with_vectors else None
+            )
+            for point in points
+        ]
+
+    def search(self, collection_name, vector, k=4, payload_filter=None, with_vectors=False,
+               exact=False, oversampling=None):
+        points = self.client.query_points(
+            collection_name=collection_name,
+            query=vector,
+            query_filter=self._filter(payload_filter),
+            limit=k,
+            with_payload=True,
+            with_vectors=with_vectors,
+            search_params=self._search_params(exact, oversampling)
+        ).points
+        return self._results(points, with_vectors)
+
+    def search_batch(self, collection_name, vectors, k=4, payload_filter=None, with_vectors=False,
+                     exact=False, oversampling=None):
+        # One round trip for all queries
+        query_filter = self._filter(payload_filter)
+        search_params = self._search_params(exact, oversampling)
+        responses = self.client.query_batch_points(
+            collection_name=collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=vector,
+                    filter=query_filter,
+                    limit=k,
+                    with_payload=True,
+                    with_vector=with_vectors,
+                    params=search_params
+                )
+                for vector in vectors
+            ]
+        )
+        return [self._results(response.points, with_vectors) for response in responses]
+
+    def exists(self, collection_name, payload_filter):
+        points, _ = self.client.scroll(
+            collection_name=collection_name,
+            scroll_filter=self._filter(payload_filter),
+            limit=1,
+            with_payload=False,
+            with_vectors=False
+        )
+        return len(points) > 0
+
+    def delete(self, collection_name, payload_filter):
+        self.client.delete(
+            collection_name=collection_name,
+            points_selector=models.FilterSelector(filter=self._filter(payload_filter))
+        )
+
+    def scroll_metadata(self, collection_name, payload_filter):
+        metadatas, offset = [], None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection_name,
+                scroll_filter=self._filter(payload_filter),
+                limit=256,
+                offset=offset,
+                with_payload=["metadata"],
+                with_vectors=False
+            )
+            metadatas.extend(point.payload.get("metadata", {}) for point in points)
+            if offset is None:
+                return metadatas
+
+    def scroll_points(self, collection_name, payload_filter, batch_size=256):
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection_name,
+                scroll_filter=self._filter(payload_filter),
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            if points:
+                yield [
+                    SearchResult(
+                        id=str(point.id),
+                        score=0.0,
+                        text=point.payload.get("page_content", ""),
+                        metadata=point.payload.get("metadata", {}),
+                        vector=point.vector
+                    )
+                    for point in points
+                ]
+            if offset is None:
+                return
+
+    @staticmethod
+    def _filter(payload_filter: Optional[PayloadFilter]) -> Optional[models.Filter]:
+        if not payload_filter:
+            return None
+        conditions = []
+        for key, value in payload_filter.items():
+            if isinstance(value, (list, tuple, set)):
+                match = models.MatchAny(any=list(value))
+            else:
+                match = models.MatchValue(value=value)
+            conditions.append(models.FieldCondition(key=f"metadata.{key}", match=match))
+        return models.Filter(must=conditions)
+
+
+class LocalCollection:
+    """One collection of the local backend.
+
+    Normalized vectors live in a memory-mapped float32 matrix (one row per
+    point) and payloads in a SQLite sidecar that maps point ids to rows.
+    Deleted rows are tombstoned and reused by later inserts.
+
+    With int8 quantization each row is also stored as int8 codes plus a
+    per-row scale; with binary quantization as packed sign bits. Searches
+    then scan only the quantized arrays and rescore the best
+    k * oversampling rows against the float32 matrix, so most of it never
+    has to be paged in.
+    """
+
+    def __init__(self, path: str, dimension: int, ann_threshold: int, quantization: str = "none",
+                 oversampling: float = 2.0):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dimension = dimension
+        self.ann_threshold = ann_threshold
+        self.quantization = quantization
+        self.oversampling = oversampling
+        self.lock = threading.RLock()
+        self._ann = None
+
+        self.db = sqlite3.connect(os.path.join(path, "payloads.db"), check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS points (
+                id TEXT PRIMARY KEY,
+                row INTEGER UNIQUE NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        """)
+        self.db.commit()
+
+        self.matrix_path = os.path.join(path, "vectors.f32")
+        rows = self.db.execute("SELECT row FROM points").fetchall()
+        self.size = max((row for row, in rows), default=-1) + 1
+        self.alive = np.zeros(self.size, dtype=bool)
+        self.alive[[row for row, in rows]] = True
+        self.free_rows = [row for row in range(self.size) if not self.alive[row]]
+        self._open_matrix(max(self.size, 1024))
+
+    @staticmethod
+    def _open_memmap(path: str, dtype, row_shape: tuple, capacity: int) -> np.memmap:
+        row_bytes = int(np.prod(row_shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+        if not os.path.exists(path) or os.path.getsize(path) < capacity * row_bytes:
+            with open(path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        rows = os.path.getsize(path) // row_bytes
+        return np.memmap(path, dtype=dtype, mode="r+", shape=(rows,) + row_shape)
+
+    def _open_matrix(self, capacity: int):
+        self.matrix = self._open_memmap(self.matrix_path, np.float32, (self.dimension,), capacity)
+        self.capacity = self.matrix.shape[0]
+        if self.quantization == "int8":
+            self.codes = self._open_memmap(os.path.join(self.path, "vectors.i8"), np.int8,
+                                           (self.dimension,), self.capacity)
+            self.scales = self._open_memmap(os.path.join(self.path, "scales.f32"), np.float32, (), self.capacity)
+        elif self.quantization == "binary":
+            self.codes = self._open_memmap(os.path.join(self.path, "vectors.bits"), np.uint8,
+                                           ((self.dimension + 7) // 8,), self.capacity)
+
+    def _flush(self):
+        self.matrix.flush()
+        if self.quantization != "none":
+            self.codes.flush()
+        if self.quantization == "int8":
+            self.scales.flush()
+
+    def _quantize(self, rows, vectors):
+        if self.quantization == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+            self.codes[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales[rows] = scales
+        elif self.quantization == "binary":
+            self.codes[rows] = np.packbits(vectors > 0, axis=1)
+
+    def set_quantization(self, quantization: str):
+        with self.lock:
+            self._flush()
+            self.quantization = quantization
+            self._open_matrix(self.capacity)
+            # Re-encode every stored vector in blocks to bound memory
+            rows = np.flatnonzero(self.alive)
+            for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+                block = rows[start:start + SCAN_BLOCK_ROWS]
+                self._quantize(block, np.asarray(self.matrix[block]))
+            self._flush()
+
+    def _allocate_row(self) -> int:
+        if self.free_rows:
+            return self.free_rows.pop()
+        row = self.size
+        self.size += 1
+        if self.size > self.capacity:
+            self._flush()
+            self._open_matrix(self.capacity * 2)
+        self.alive = np.resize(self.alive, self.size)
+        self.alive[row] = False
+        return row
+
+    def upsert(self, ids, vectors, texts, metadatas):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self.lock:
+            existing = dict(self.db.execute(
+                f"SELECT id, row FROM points WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()) if ids else {}
+            records = []
+            rows = []
+            for point_id, vector, text, metadata in zip(ids, vectors, texts, metadatas):
+                row = existing.get(point_id)
+                if row is None:
+                    row = self._allocate_row()
+                self.matrix[row] = vector
+                self.alive[row] = True
+                rows.append(row)
+                records.append((point_id, row, text, json.dumps(metadata)))
+                if self._ann is not None:
+                    self._ann_add(row, vector)
+            self._quantize(np.array(rows, dtype=np.int64), vectors)
+            self._flush()
+            self.db.executemany(
+                "INSERT OR REPLACE INTO points (id, row, text, metadata) VALUES (?, ?, ?, ?)", records
+            )
+            self.db.commit()
+
+    def create_index(self, field: str):
+        path = self._json_path(field)
+        with self.lock:
+            self.db.execute(
+                f"CREATE INDEX IF NOT EXISTS points_{field} ON points (json_extract(metadata, '{path}'))"
+            )
+            self.db.commit()
+
+    @staticmethod
+    def _json_path(field: str) -> str:
+        # Paths are inlined (not bound) so SQLite can match them to expression indexes
+        if not re.fullmatch(r"\w+", field):
+            raise ValueError(f"Invalid payload field: {field}")
+        return f"$.{field}"
+
+    def _where(self, payload_filter: Optional[PayloadFilter]):
+        clauses, params = [], []
+        for key, value in (payload_filter or {}).items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            clauses.append(f"json_extract(metadata, '{self._json_path(key)}') IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def search(self, vector, k, payload_filter=None, with_vectors=False, exact=False, oversampling=None):
+        return self.search_batch([vector], k, payload_filter, with_vectors, exact, oversampling)[0]
+
+    def search_batch(self, vectors, k, payload_filter=None, with_vectors=False, exact=False, oversampling=None):
+        queries = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        with self.lock:
+            # The filter is resolved once for the whole batch
+            if payload_filter:
+                where, params = self._where(payload_filter)
+                rows = np.array([row for row, in self.db.execute(f"SELECT row FROM points{where}", params)],
+                                dtype=np.int64)
+            else:
+                rows = None
+
+            # HNSW only pays off when the points being searched (after the filter) are numerous
+            searched = int(self.alive.sum()) if rows is None else len(rows)
+            if exact or (self.quantization == "none" and (hnswlib is None or searched < self.ann_threshold)):
+                matches = self._exact_batch(queries, k, np.flatnonzero(self.alive) if rows is None else rows)
+            elif self.quantization != "none":
+                matches = [
+                    self._quantized(query, k, np.flatnonzero(self.alive) if rows is None else rows,
+                                    oversampling or self.oversampling)
+                    for query in queries
+                ]
+            else:
+                matches = [self._approximate(query, k, rows) for query in queries]
+
+            return [self._results(candidates, scores, with_vectors) for candidates, scores in matches]
+
+    def _results(self, candidates, scores, with_vectors):
+        results = []
+        for row, score in zip(candidates.tolist(), scores.tolist()):
+            point_id, text, metadata = self.db.execute(
+                "SELECT id, text, metadata FROM points WHERE row = ?", (row,)
+            ).fetchone()
+            results.append(SearchResult(
+                id=point_id,
+                score=score,
+                text=text,
+                metadata=json.loads(metadata),
+                vector=self.matrix[row].tolist() if with_vectors else None
+            ))
+        return results
+
+    def _exact_batch(self, queries, k, rows):
+        # One matrix product scores every query against every candidate row
+        if len(rows) == 0:
+            return [(rows, np.zeros(0, dtype=np.float32)) for _ in queries]
+        scores = self.matrix[rows] @ queries.T
+        matches = []
+        for column in range(len(queries)):
+            top = self._top(scores[:, column], k)
+            matches.append((rows[top], scores[top, column]))
+        return matches
+
+    def _exact(self, query, k, rows):
+        if len(rows) == 0:
+            return rows, np.zeros(0, dtype=np.float32)
+        scores = self.matrix[rows] @ query
+        top = self._top(scores, k)
+        return rows[top], scores[top]
+
+    @staticmethod
+    def _top(scores, k):
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def _quantized(self, query, k, rows, oversampling):
+        if len(rows) == 0:
+            return rows, np.zeros(0, dtype=np.float32)
+        if self.quantization == "int8":
+            query_scale = max(np.abs(query).max(), 1e-12) / 127
+            query_codes = np.round(query / query_scale).astype(np.int32)
+        else:
+            query_bits = np.packbits(query > 0)
+        # Widening the codes for the product costs as much memory as float32 rows, so only one block at a time
+        approx = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+            block = rows[start:start + SCAN_BLOCK_ROWS]
+            if self.quantization == "int8":
+                approx[start:start + len(block)] = (self.codes[block].astype(np.int32) @ query_codes) * self.scales[block]
+            else:
+                # Fewer differing sign bits means a closer vector
+                approx[start:start + len(block)] = -POPCOUNT[np.bitwise_xor(self.codes[block], query_bits)].sum(
+                    axis=1, dtype=np.int64
+                )
+        candidates = rows[self._top(approx, max(k, int(k * oversampling)))]
+        return self._exact(query, k, np.sort(candidates))
+
+    def _approximate(self, query, k, rows=None):
+        if self._ann is None:
+            self._build_ann()
+        if rows is None:
+            rows_filter, available = None, int(self.alive.sum())
+        else:
+            # hnswlib only follows graph nodes whose label passes the filter, so payload filters still use the index
+            allowed = np.zeros(self.size, dtype=bool)
+            allowed[rows] = True
+            rows_filter, available = (lambda label: bool(allowed[label])), len(rows)
+        try:
+            labels, distances = self._ann.knn_query(query, k=min(k, available), filter=rows_filter)
+        except RuntimeError:
+            # HNSW can come up short after many deletions (or with a selective filter); fall back to an exact scan
+            return self._exact(query, k, np.flatnonzero(self.alive) if rows is None else rows)
+        return labels[0].astype(np.int64), 1 - distances[0]
+
+    def _build_ann(self):
+        index = hnswlib.Index(space="ip", dim=self.dimension)
+        index.init_index(max_elements=max(self.capacity, self.ann_threshold), ef_construction=200, M=16)
+        index.set_ef(64)
+        rows = np.flatnonzero(self.alive)
+        if len(rows):
+            index.add_items(self.matrix[rows], rows)
+        self._ann = index
+
+    def _ann_add(self, row, vector):
+        if row >= self._ann.get_max_elements():
+            self._ann.resize_index(self.capacity)
+        self._ann.add_items(vector[None, :], [row], replace_deleted=False)
+        try:
+            self._ann.unmark_deleted(row)
+        except RuntimeError:
+            pass
+
+    def exists(self, payload_filter):
+        where, params = self._where(payload_filter)
+        with self.lock:
+            return self.db.execute(f"SELECT 1 FROM points{where} LIMIT 1", params).fetchone() is not None
+
+    def scroll_metadata(self, payload_filter):
+        where, params = self._where(payload_filter)
+        with self.lock:
+            return [json.loads(metadata) for metadata, in self.db.execute(f"SELECT metadata FROM points{where}", params)]
+
+    def scroll_points(self, payload_filter, batch_size=256):
+        where, params = self._where(payload_filter)
+        # Paged by row, so only one page is held (and the lock only while reading it) at a time
+        where += (" AND" if where else " WHERE") + " row > ?"
+        last_row = -1
+        while True:
+            with self.lock:
+                page = self.db.execute(
+                    f"SELECT id, row, text, metadata FROM points{where} ORDER BY row LIMIT ?",
+                    [*params, last_row, batch_size]
+                ).fetchall()
+                points = [
+                    SearchResult(id=point_id, score=0.0, text=text, metadata=json.loads(metadata),
+                                 vector=self.matrix[row].tolist())
+                    for point_id, row, text, metadata in page
+                ]
+            if points:
+                yield points
+            if len(page) < batch_size:
+                return
+            last_row = page[-1][1]
+
+    def delete(self, payload_filter):
+        where, params = self._where(payload_filter)
+        with self.lock:
+            rows = [row for row, in self.db.execute(f"SELECT row FROM points{where}", params)]
+            self.db.execute(f"DELETE FROM points{where}", params)
+            self.db.commit()
+            for row in rows:
+                self.alive[row] = False
+                self.free_rows.append(row)
+                if self._ann is not None:
+                    self._ann.mark_deleted(row)
+
+
+def _lock_exclusively(path: str):
+    # Held until the file is closed, which the OS does when the process exits
+    lock_file = open(path, "a+")
+    try:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            import msvcrt
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        raise
+    return lock_file
+
+
+class LocalVectorStore(VectorStore):
+    """Embedded, on-disk backend for single-node deployments and tests.
+
+    Search is brute-force NumPy top-k; if hnswlib is installed, an HNSW graph
+    index is built in memory and used whenever a search covers at least
+    ann_threshold points (after payload filtering).
+
+    Free-row bookkeeping and the memmaps live in this process, so the index
+    directory is locked to it: a second process (another API worker, or the
+    quantization tool while the API runs) fails to open it instead of
+    overwriting rows the first one handed out.
+    """
+
+    def __init__(self, path: str, ann_threshold: int = 50000, quantization: str = "none",
+                 oversampling: float = 2.0):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {quantization}")
+        self.path = path
+        self.ann_threshold = ann_threshold
+        self.quantization = quantization
+        self.oversampling = oversampling
+        self._collections: Dict[str, LocalCollection] = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        try:
+            self._lock_file = _lock_exclusively(os.path.join(path, ".lock"))
+        except OSError:
+            raise RuntimeError(
+                f"{path} is already open in another process; the local vector store supports one process, "
+                "so run several API workers with VECTOR_STORE=qdrant"
+            ) from None
+
+    def _collection(self, collection_name: str, dimension: Optional[int] = None) -> LocalCollection:
+        with self._lock:
+            collection = self._collections.get(collection_name)
+            if collection is None:
+                path = os.path.join(self.path, collection_name)
+                config_path = os.path.join(path, "config.json")
+                if os.path.exists(config_path):
+                    with open(config_path) as f:
+                        config = json.load(f)
+                elif dimension is None:
+                    raise ValueError(f"Collection {collection_name} does not exist")
+                else:
+                    config = {"dimension": dimension, "quantization": self.quantization}
+                    os.makedirs(path, exist_ok=True)
+                    with open(config_path, "w") as f:
+                        json.dump(config, f)
+                collection = LocalCollection(
+                    path, config["dimension"], self.ann_threshold,
+                    quantization=config.get("quantization", "none"),
+                    oversampling=self.oversampling
+                )
+                self._collections[collection_name] = collection
+            return collection
+
+    def ensure_collection(self, collection_name, dimension, indexed_fields=()):
+        collection = self._collection(collection_name, dimension)
+        for field in indexed_fields:
+            collection.create_index(field)
+
+    def upsert(self, collection_name, ids, vectors, texts, metadatas):
+        self._collection(collection_name).upsert(ids, vectors, texts, metadatas)
+
+    def search(self, collection_name, vector, k=4, payload_filter=None, with_vectors=False,
+               exact=False, oversampling=None):
+        return self._collection(collection_name).search(vector, k, payload_filter, with_vectors, exact, oversampling)
+
+    def search_batch(self, collection_name, vectors, k=4, payload_filter=None, with_vectors=False,
+                     exact=False, oversampling=None):
+        return self._collection(collection_name).search_batch(
+            vectors, k, payload_filter, with_vectors, exact, oversampling
+        )
+
+    def set_quantization(self, collection_name, quantization):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {quantization}")
+        collection = self._collection(collection_name)
+        collection.set_quantization(quantization)
+        with open(os.path.join(collection.path, "config.json"), "w") as f:
+            json.dump({"dimension": collection.dimension, "quantization": quantization}, f)
+
+    def get_quantization(self, collection_name):
+        return self._collection(collection_name).quantization
+
+    def exists(self, collection_name, payload_filter):
+        return self._collection(collection_name).exists(payload_filter)
+
+    def delete(self, collection_name, payload_filter):
+        self._collection(collection_name).delete(payload_filter)
+
+    def scroll_metadata(self, collection_name, payload_filter):
+        return self._collection(collection_name).scroll_metadata(payload_filter)
+
+    def scroll_points(self, collection_name, payload_filter, batch_size=256):
+        return self._collection(collection_name).scroll_points(payload_filter, batch_size)
+
+
+def create_vector_store() -> VectorStore:
+    backend = os.getenv("VECTOR_STORE", "qdrant").lower()
+    quantization = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+    oversampling = float(os.getenv("VECTOR_OVERSAMPLING", "2.0"))
+    if backend == "local":
+        return LocalVectorStore(
+            os.getenv("LOCAL_INDEX_PATH", "vector_index"),
+            ann_threshold=int(os.getenv("LOCAL_ANN_THRESHOLD", "50000")),
+            quantization=quantization,
+            oversampling=oversampling
+        )
+    if backend == "qdrant":
+        return QdrantVectorStore(
+            os.getenv("QDRANT_URL"),
+            os.getenv("QDRANT_API_KEY"),
+            quantization=quantization,
+            oversampling=oversampling
+        )
+    raise ValueError(f"Unknown VECTOR_STORE backend: {backend}")
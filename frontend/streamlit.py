@@ -1,227 +1,365 @@
-# frontend/app.py
-import streamlit as st
-import requests
-import json
-from typing import Optional
-import time
-
-# API Configuration
-API_BASE_URL = "http://localhost:8000"  # Update with your API URL
-
-class APIClient:
-    def __init__(self, base_url: str):
-        self.base_url = base_url
-        self.session = requests.Session()
-
-    def register(self, email: str, password: str) -> dict:
-        response = requests.post(
-            f"{self.base_url}/register",
-            json={"email": email, "password": password}
-        )
-        return response.json() if response.ok else None
-
-    def login(self, email: str, password: str) -> Optional[str]:
-        response = requests.post(
-            f"{self.base_url}/token",
-            json={"username": email, "password": password}  # Use json instead of data
-        )
-        if response.ok:
-            return response.json()
-        return None
-
-
-    def upload_pdfs(self, files):
-        files_dict = {f"files": (file.name, file, "application/pdf") for file in files}
-        
-        response = requests.post(
-            f"{self.base_url}/upload-pdfs",  # No need for token anymore
-            files=files_dict
-        )
-        return response.json() if response.ok else None
-
-    def ask_question(self, question: str) -> Optional[str]:
-        response = requests.post(
-            f"{self.base_url}/ask",  # No need for token anymore
-            json={"question": question}
-        )
-        return response.json()["answer"] if response.ok else None
-
-# Initialize API client
-api_client = APIClient(API_BASE_URL)
-
-def render_login_page():
-    st.markdown("""
-    <style>
-        .title-container {
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            height: 100%;
-            text-align: justify;
-        }
-        .title-text {
-            font-size: 2rem;
-            font-weight: bold;
-            color: #0f2b46;
-        }
-    </style>
-    <div class="title-container">
-        <div class="title-text">
-            Access Portal 👋
-        </div>
-    </div>
-""", unsafe_allow_html=True)
-    
-    with st.container():
-        st.markdown("""<style> ... </style>""", unsafe_allow_html=True)
-        
-        col1, col2, col3 = st.columns([1, 2, 1])
-        
-        with col2:
-            if "login_email" not in st.session_state:
-                st.session_state.login_email = ""
-            if "login_password" not in st.session_state:
-                st.session_state.login_password = ""
-                
-            def handle_login():
-                if st.session_state.login_email and st.session_state.login_password:
-                    with st.spinner("Logging in..."):
-                        response = api_client.login(
-                            st.session_state.login_email,
-                            st.session_state.login_password
-                        )
-                        if response and response.get("message") == "Login successful":
-                            st.session_state.user_email = st.session_state.login_email
-                            st.session_state.page = "chat"
-                            st.rerun()
-                        else:
-                            st.error("Invalid email or password!")
-                else:
-                    st.warning("Please fill in all fields")
-            
-            with st.form("login_form", clear_on_submit=False):
-                st.subheader("Login to Your Account")
-                st.text_input("Email Address", key="login_email", placeholder="your@email.com")
-                st.text_input("Password", key="login_password", type="password", placeholder="Enter your password")
-                st.form_submit_button("Sign In", use_container_width=True, on_click=handle_login)
-            
-            st.markdown("<div style='text-align: center;'>Don't have an account?</div>", unsafe_allow_html=True)
-            if st.button("Create Account", use_container_width=True):
-                st.session_state.page = "register"
-                st.rerun()
-
-def render_register_page():
-    st.title("Create Account ✨")
-    
-    with st.container():
-        st.markdown("""<style> ... </style>""", unsafe_allow_html=True)
-        
-        col1, col2, col3 = st.columns([1, 2, 1])
-        
-        with col2:
-            if "register_email" not in st.session_state:
-                st.session_state.register_email = ""
-            if "register_password" not in st.session_state:
-                st.session_state.register_password = ""
-            if "register_confirm" not in st.session_state:
-                st.session_state.register_confirm = ""
-                
-            def handle_register():
-                if not all([st.session_state.register_email, 
-                          st.session_state.register_password, 
-                          st.session_state.register_confirm]):
-                    st.warning("Please fill in all fields")
-                    return
-                if st.session_state.register_password != st.session_state.register_confirm:
-                    st.error("Passwords don't match!")
-                    return
-                if len(st.session_state.register_password) < 6:
-                    st.error("Password must be at least 6 characters long!")
-                    return
-                
-                with st.spinner("Creating account..."):
-                    result = api_client.register(
-                        st.session_state.register_email,
-                        st.session_state.register_password
-                    )
-                    if result:
-                        st.success("Registration successful! Please login.")
-                        time.sleep(1)
-                        st.session_state.page = "login"
-                        st.rerun()
-                    else:
-                        st.error("Email already registered!")
-            
-            with st.form("register_form", clear_on_submit=False):
-                st.subheader("Sign Up for Free")
-                st.text_input("Email Address", key="register_email", placeholder="your@email.com")
-                st.text_input("Password", key="register_password", type="password", placeholder="Choose a strong password")
-                st.text_input("Confirm Password", key="register_confirm", type="password", placeholder="Repeat your password")
-                st.markdown("<div>Password must be at least 6 characters long</div>", unsafe_allow_html=True)
-                st.form_submit_button("Create Account", use_container_width=True, on_click=handle_register)
-            
-            st.markdown("<div style='text-align: center;'>Already have an account?</div>", unsafe_allow_html=True)
-            if st.button("Back to Login", use_container_width=True):
-                st.session_state.page = "login"
-                st.rerun()
-
-def render_chat_page():
-    st.title("📄 PDF Chat Assistant")
-    with st.sidebar:
-        st.markdown(f"<h3>{st.session_state.user_email}</h3>", unsafe_allow_html=True)
-        st.markdown("---")
-        with st.expander("📁 Document Management", expanded=True):
-            pdf_docs = st.file_uploader("Upload PDFs", accept_multiple_files=True, type=['pdf'])
-            if st.button("Process Documents", use_container_width=True):
-                if pdf_docs:
-                    with st.spinner("Processing..."):
-                        result = api_client.upload_pdfs(pdf_docs)
-                        if result:
-                            st.success("✅ Processing complete!")
-                        else:
-                            st.error("Error processing documents")
-                else:
-                    st.warning("Please upload PDFs first")
-        if st.button("Logout", use_container_width=True):
-            st.session_state.clear()
-            st.rerun()
-
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-
-    for message in st.session_state.messages:
-        with st.container():
-            if message["role"] == "user":
-                st.markdown(f"<div>{message['content']}</div>", unsafe_allow_html=True)
-            else:
-                st.markdown(f"<div>{message['content']}</div>", unsafe_allow_html=True)
-
-    def handle_input():
-        if st.session_state.user_input.strip():
-            user_question = st.session_state.user_input
-            st.session_state.messages.append({"role": "user", "content": user_question})
-            with st.spinner("Thinking..."):
-                response = api_client.ask_question(user_question)
-                if response:
-                    st.session_state.messages.append({"role": "assistant", "content": response})
-                else:
-                    st.error("Error getting response")
-            st.session_state.user_input = ""
-
-    with st.container():
-        st.text_input("Ask a question...", key="user_input", on_change=handle_input)
-        st.button("Send", use_container_width=True, on_click=handle_input)
-
-def main():
-    if 'page' not in st.session_state:
-        st.session_state.page = 'login'
-    
-    if st.session_state.page == "login":
-        render_login_page()
-    elif st.session_state.page == "register":
-        render_register_page()
-    elif st.session_state.page == "chat":
-        render_chat_page()
-
-if __name__ == "__main__":
-    main()
+# frontend/app.py
+import streamlit as st
+import requests
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, Optional, Tuple
+import time
+
+# API Configuration
+API_BASE_URL = "http://localhost:8000"  # Update with your API URL
+UPLOAD_CONCURRENCY = 4  # Files uploaded in parallel, one request (and one ingestion job) each
+UPLOAD_MAX_WAIT = 300   # Seconds one file may spend waiting out a full ingestion queue (503) or the upload rate limit (429)
+JOB_POLL_SECONDS = 2    # How often the sidebar refreshes ingestion progress
+
+class APIClient:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        # One keep-alive session, with enough pooled connections for parallel uploads
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=UPLOAD_CONCURRENCY + 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.token = None
+
+    def _headers(self) -> dict:
+        # The session token from login; the API scopes documents and questions by it
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    def register(self, email: str, password: str) -> dict:
+        response = self.session.post(
+            f"{self.base_url}/register",
+            json={"email": email, "password": password}
+        )
+        return response.json() if response.ok else None
+
+    def login(self, email: str, password: str) -> Optional[str]:
+        response = self.session.post(
+            f"{self.base_url}/token",
+            json={"username": email, "password": password}  # Use json instead of data
+        )
+        if response.ok:
+            return response.json()
+        return None
+
+    def logout(self):
+        self.session.post(f"{self.base_url}/logout", headers=self._headers())
+        self.token = None
+
+    def upload_pdf(self, file) -> Optional[dict]:
+        waited = 0.0
+        while True:
+            file.seek(0)
+            response = self.session.post(
+                f"{self.base_url}/upload-pdfs",
+                files=[("files", (file.name, file, "application/pdf"))],
+                headers=self._headers()
+            )
+            # The ingestion queue is full or we are over the upload rate limit;
+            # wait as long as the server asks and try again
+            if response.status_code in (429, 503):
+                delay = float(response.headers.get("Retry-After", "5"))
+                if waited + delay <= UPLOAD_MAX_WAIT:
+                    time.sleep(delay)
+                    waited += delay
+                    continue
+            return response.json() if response.ok else None
+
+    def upload_pdfs(self, files) -> Iterator[Tuple[int, Optional[dict]]]:
+        # Yields (index into files, upload response) as each upload finishes
+        with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as pool:
+            futures = {pool.submit(self.upload_pdf, file): index for index, file in enumerate(files)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        # None only when the job is gone; other failures raise, so a hiccup doesn't drop the job
+        response = self.session.get(f"{self.base_url}/jobs/{job_id}", headers=self._headers())
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def list_documents(self) -> list:
+        response = self.session.get(f"{self.base_url}/documents", headers=self._headers())
+        return response.json() if response.ok else []
+
+    def delete_document(self, doc_hash: str) -> bool:
+        response = self.session.delete(f"{self.base_url}/documents/{doc_hash}", headers=self._headers())
+        return response.ok
+
+    def ask_question(self, question: str, documents: Optional[list] = None) -> Optional[str]:
+        response = self.session.post(
+            f"{self.base_url}/ask",
+            json={"question": question, "documents": documents or None},
+            headers=self._headers()
+        )
+        return response.json()["answer"] if response.ok else None
+
+    def stream_question(self, question: str, documents: Optional[list] = None):
+        # Yields (event, data) pairs parsed from the server-sent event stream
+        with self.session.post(
+            f"{self.base_url}/ask/stream",
+            json={"question": question, "documents": documents or None},
+            headers=self._headers(),
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            event = "message"
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    yield event, json.loads(line[len("data:"):].strip())
+                    event = "message"
+
+def get_api_client():
+    # The script re-runs on every interaction; keep one client (and its pooled
+    # connections) per browser session rather than per run
+    if "api_client" not in st.session_state:
+        st.session_state.api_client = APIClient(API_BASE_URL)
+    return st.session_state.api_client
+
+def render_login_page():
+    st.markdown("""
+    <style>
+        .title-container {
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            height: 100%;
+            text-align: justify;
+        }
+        .title-text {
+            font-size: 2rem;
+            font-weight: bold;
+            color: #0f2b46;
+        }
+    </style>
+    <div class="title-container">
+        <div class="title-text">
+            Access Portal 👋
+        </div>
+    </div>
+""", unsafe_allow_html=True)
+    
+    with st.container():
+        st.markdown("""<style> ... </style>""", unsafe_allow_html=True)
+        
+        col1, col2, col3 = st.columns([1, 2, 1])
+        
+        with col2:
+            if "login_email" not in st.session_state:
+                st.session_state.login_email = ""
+            if "login_password" not in st.session_state:
+                st.session_state.login_password = ""
+                
+            def handle_login():
+                if st.session_state.login_email and st.session_state.login_password:
+                    with st.spinner("Logging in..."):
+                        api_client = get_api_client()
+                        response = api_client.login(
+                            st.session_state.login_email,
+                            st.session_state.login_password
+                        )
+                        if response and response.get("message") == "Login successful":
+                            st.session_state.user_email = st.session_state.login_email
+                            api_client.token = response.get("access_token")
+                            st.session_state.page = "chat"
+                            st.rerun()
+                        else:
+                            st.error("Invalid email or password!")
+                else:
+                    st.warning("Please fill in all fields")
+            
+            with st.form("login_form", clear_on_submit=False):
+                st.subheader("Login to Your Account")
+                st.text_input("Email Address", key="login_email", placeholder="your@email.com")
+                st.text_input("Password", key="login_password", type="password", placeholder="Enter your password")
+                st.form_submit_button("Sign In", use_container_width=True, on_click=handle_login)
+            
+            st.markdown("<div style='text-align: center;'>Don't have an account?</div>", unsafe_allow_html=True)
+            if st.button("Create Account", use_container_width=True):
+                st.session_state.page = "register"
+                st.rerun()
+
+def render_register_page():
+    st.title("Create Account ✨")
+    
+    with st.container():
+        st.markdown("""<style> ... </style>""", unsafe_allow_html=True)
+        
+        col1, col2, col3 = st.columns([1, 2, 1])
+        
+        with col2:
+            if "register_email" not in st.session_state:
+                st.session_state.register_email = ""
+            if "register_password" not in st.session_state:
+                st.session_state.register_password = ""
+            if "register_confirm" not in st.session_state:
+                st.session_state.register_confirm = ""
+                
+            def handle_register():
+                if not all([st.session_state.register_email, 
+                          st.session_state.register_password, 
+                          st.session_state.register_confirm]):
+                    st.warning("Please fill in all fields")
+                    return
+                if st.session_state.register_password != st.session_state.register_confirm:
+                    st.error("Passwords don't match!")
+                    return
+                if len(st.session_state.register_password) < 6:
+                    st.error("Password must be at least 6 characters long!")
+                    return
+                
+                with st.spinner("Creating account..."):
+                    result = get_api_client().register(
+                        st.session_state.register_email,
+                        st.session_state.register_password
+                    )
+                    if result:
+                        st.success("Registration successful! Please login.")
+                        time.sleep(1)
+                        st.session_state.page = "login"
+                        st.rerun()
+                    else:
+                        st.error("Email already registered!")
+            
+            with st.form("register_form", clear_on_submit=False):
+                st.subheader("Sign Up for Free")
+                st.text_input("Email Address", key="register_email", placeholder="your@email.com")
+                st.text_input("Password", key="register_password", type="password", placeholder="Choose a strong password")
+                st.text_input("Confirm Password", key="register_confirm", type="password", placeholder="Repeat your password")
+                st.markdown("<div>Password must be at least 6 characters long</div>", unsafe_allow_html=True)
+                st.form_submit_button("Create Account", use_container_width=True, on_click=handle_register)
+            
+            st.markdown("<div style='text-align: center;'>Already have an account?</div>", unsafe_allow_html=True)
+            if st.button("Back to Login", use_container_width=True):
+                st.session_state.page = "login"
+                st.rerun()
+
+def render_upload_jobs():
+    # Ingestion runs in the background; this only polls its progress
+    api_client = get_api_client()
+    jobs = st.session_state.setdefault("upload_jobs", {})
+    finished = []
+    for job_id, filename in list(jobs.items()):
+        try:
+            status = api_client.get_job(job_id)
+        except requests.RequestException:
+            st.caption(f"{filename}: status unavailable, retrying")
+            continue
+        if status is None:
+            del jobs[job_id]
+            continue
+        done, total = status["pages_done"], status["pages_total"]
+        if status["stage"] == "failed":
+            st.error(f"{filename}: {status['error']}")
+            finished.append(job_id)
+        elif status["stage"] == "completed":
+            st.progress(1.0, text=f"✅ {filename}")
+            finished.append(job_id)
+        else:
+            st.progress(done / total if total else 0.0, text=f"{filename}: {status['stage']} ({done}/{total} pages)")
+    if finished and st.button("Clear finished", use_container_width=True):
+        for job_id in finished:
+            del jobs[job_id]
+        st.rerun()
+
+# Refresh just the job list every few seconds, so chatting is never blocked by it
+if hasattr(st, "fragment"):
+    render_upload_jobs = st.fragment(run_every=JOB_POLL_SECONDS)(render_upload_jobs)
+
+def render_chat_page():
+    st.title("📄 PDF Chat Assistant")
+    api_client = get_api_client()
+    with st.sidebar:
+        st.markdown(f"<h3>{st.session_state.user_email}</h3>", unsafe_allow_html=True)
+        st.markdown("---")
+        with st.expander("📁 Document Management", expanded=True):
+            pdf_docs = st.file_uploader("Upload PDFs", accept_multiple_files=True, type=['pdf'])
+            if st.button("Process Documents", use_container_width=True):
+                if pdf_docs:
+                    jobs = st.session_state.setdefault("upload_jobs", {})
+                    progress = [st.progress(0.0, text=f"{doc.name}: uploading") for doc in pdf_docs]
+                    for index, result in api_client.upload_pdfs(pdf_docs):
+                        if result:
+                            jobs[result["job_id"]] = pdf_docs[index].name
+                            progress[index].progress(1.0, text=f"{pdf_docs[index].name}: queued")
+                        else:
+                            progress[index].progress(0.0, text=f"❌ {pdf_docs[index].name}: upload failed")
+                else:
+                    st.warning("Please upload PDFs first")
+            render_upload_jobs()
+        with st.expander("📚 My Documents", expanded=False):
+            documents = api_client.list_documents()
+            names = {doc["doc_hash"]: doc["pdf_name"] for doc in documents}
+            st.multiselect(
+                "Ask only about",
+                options=list(names),
+                format_func=lambda doc_hash: names[doc_hash],
+                key="selected_documents"
+            )
+            for doc in documents:
+                col1, col2 = st.columns([3, 1])
+                col1.markdown(f"<div>{doc['pdf_name']}</div>", unsafe_allow_html=True)
+                if col2.button("🗑️", key=f"delete_{doc['doc_hash']}"):
+                    api_client.delete_document(doc["doc_hash"])
+                    st.rerun()
+        if st.button("Logout", use_container_width=True):
+            api_client.logout()
+            st.session_state.clear()
+            st.rerun()
+
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
+
+    for message in st.session_state.messages:
+        with st.container():
+            if message["role"] == "user":
+                st.markdown(f"<div>{message['content']}</div>", unsafe_allow_html=True)
+            else:
+                st.markdown(f"<div>{message['content']}</div>", unsafe_allow_html=True)
+
+    # Stream the answer to a question submitted on the previous run
+    if st.session_state.get("pending_question"):
+        user_question = st.session_state.pop("pending_question")
+        placeholder = st.empty()
+        placeholder.markdown("<div>Thinking...</div>", unsafe_allow_html=True)
+        answer = ""
+        try:
+            events = api_client.stream_question(user_question, st.session_state.get("selected_documents"))
+            for event, data in events:
+                if event == "token":
+                    answer += data["text"]
+                    placeholder.markdown(f"<div>{answer}</div>", unsafe_allow_html=True)
+                elif event == "error":
+                    raise RuntimeError(data.get("detail"))
+            st.session_state.messages.append({"role": "assistant", "content": answer})
+        except Exception:
+            st.error("Error getting response")
+
+    def handle_input():
+        if st.session_state.user_input.strip():
+            user_question = st.session_state.user_input
+            st.session_state.messages.append({"role": "user", "content": user_question})
+            st.session_state.pending_question = user_question
+            st.session_state.user_input = ""
+
+    with st.container():
+        st.text_input("Ask a question...", key="user_input", on_change=handle_input)
+        st.button("Send", use_container_width=True, on_click=handle_input)
+
+def main():
+    if 'page' not in st.session_state:
+        st.session_state.page = 'login'
+    
+    if st.session_state.page == "login":
+        render_login_page()
+    elif st.session_state.page == "register":
+        render_register_page()
+    elif st.session_state.page == "chat":
+        render_chat_page()
+
+if __name__ == "__main__":
+    main()